@@ -1,17 +1,66 @@
-from flask import Flask, request, jsonify, send_file
+import time
+IMPORT_STARTED = time.perf_counter()  # import cost is reported at boot
+
+from flask import Flask, Request, request, jsonify, g
+from werkzeug.wsgi import wrap_file
 from flask_cors import CORS
 import os
 import numpy as np
-import librosa
 import soundfile as sf
 from pydub import AudioSegment
-from pydub.generators import Sine, Square, Sawtooth, Triangle
-from pydub.utils import which
+from pydub.utils import which, get_prober_name
 import io
+import array
 import json
 from datetime import datetime
 import random
 import sys
+import hashlib
+import threading
+import uuid
+import subprocess
+import tempfile
+import struct
+import zipfile
+import shutil
+import bisect
+import importlib
+import mimetypes
+import mmap
+import sqlite3
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from collections import OrderedDict
+from contextlib import contextmanager
+
+class LazyModule:
+    """Stand-in for a heavy module that imports it on first attribute access
+    
+    How long each import took is kept in lazy_import_seconds so startup
+    reports and /api/metrics can show where cold-start time goes.
+    """
+    
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+    
+    def load(self):
+        if self._module is None:
+            started = time.perf_counter()
+            module = importlib.import_module(self._name)
+            lazy_import_seconds.setdefault(self._name, time.perf_counter() - started)
+            self._module = module
+        return self._module
+    
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+lazy_import_seconds = {}
+
+# scipy.signal alone takes most of the import time; only filters, windows
+# and the analysis resampler need it
+signal = LazyModule('scipy.signal')
 
 app = Flask(__name__)
 CORS(app)
@@ -19,8 +68,84 @@ CORS(app)
 # Create directories for uploads and generated files
 UPLOAD_FOLDER = 'uploads'
 GENERATED_FOLDER = 'generated'
+TRANSCODE_FOLDER = os.path.join(GENERATED_FOLDER, 'transcoded')
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(GENERATED_FOLDER, exist_ok=True)
+os.makedirs(TRANSCODE_FOLDER, exist_ok=True)
+
+# Result cache limits (entries, total bytes on disk, age in seconds)
+RESULT_CACHE_MAX_ENTRIES = int(os.environ.get('RESULT_CACHE_MAX_ENTRIES', 256))
+RESULT_CACHE_MAX_BYTES = int(os.environ.get('RESULT_CACHE_MAX_BYTES', 1024 * 1024 * 1024))
+RESULT_CACHE_MAX_AGE = int(os.environ.get('RESULT_CACHE_MAX_AGE', 7 * 24 * 3600))
+
+# Every file in GENERATED_FOLDER is indexed in a manifest; a janitor thread
+# deletes the least recently used ones once they pass OUTPUT_STORE_MAX_BYTES,
+# checking every OUTPUT_STORE_JANITOR_INTERVAL seconds
+OUTPUT_STORE_MAX_BYTES = int(os.environ.get('OUTPUT_STORE_MAX_BYTES', 10 * 1024 * 1024 * 1024))
+OUTPUT_STORE_JANITOR_INTERVAL = int(os.environ.get('OUTPUT_STORE_JANITOR_INTERVAL', 60))
+
+# Background job workers, pending-job limit and how long finished jobs are kept
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', os.cpu_count() or 2))
+JOB_QUEUE_DEPTH = int(os.environ.get('JOB_QUEUE_DEPTH', 32))
+JOB_RETENTION = int(os.environ.get('JOB_RETENTION', 3600))
+
+# Remixes of uploads above this size (or with streaming=true) run block-wise
+REMIX_STREAMING_THRESHOLD = int(os.environ.get('REMIX_STREAMING_THRESHOLD', 50 * 1024 * 1024))
+STREAM_BLOCK_SIZE = int(os.environ.get('STREAM_BLOCK_SIZE', 65536))
+
+# Memory budget for cached, enveloped note buffers used by the synthesizer
+NOTE_CACHE_MAX_BYTES = int(os.environ.get('NOTE_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+
+# Threads rendering the layers of a layered mix (NumPy releases the GIL in
+# the FFT and array kernels) and the most layers one remix may request
+LAYER_WORKERS = int(os.environ.get('LAYER_WORKERS', os.cpu_count() or 2))
+REMIX_MAX_LAYERS = int(os.environ.get('REMIX_MAX_LAYERS', 8))
+
+# Loudness normalization: integrated loudness target (LUFS), true-peak
+# ceiling (dBTP) and the most gain a quiet track may get (dB)
+TARGET_LOUDNESS = float(os.environ.get('TARGET_LOUDNESS', -14.0))
+TRUE_PEAK_CEILING = float(os.environ.get('TRUE_PEAK_CEILING', -1.0))
+LOUDNESS_MAX_GAIN = float(os.environ.get('LOUDNESS_MAX_GAIN', 24.0))
+
+# Most specs accepted by one /api/generate/batch call
+BATCH_MAX_SPECS = int(os.environ.get('BATCH_MAX_SPECS', 64))
+
+# Longest track /api/generate/stream will render, in seconds
+STREAM_GENERATE_MAX_DURATION = int(os.environ.get('STREAM_GENERATE_MAX_DURATION', 600))
+
+# Uploads up to this size stay in memory; larger ones spill to an anonymous file
+UPLOAD_SPOOL_THRESHOLD = int(os.environ.get('UPLOAD_SPOOL_THRESHOLD', 16 * 1024 * 1024))
+
+# Encoded /api/stream variants kept in TRANSCODE_FOLDER (entries, total bytes)
+TRANSCODE_CACHE_MAX_ENTRIES = int(os.environ.get('TRANSCODE_CACHE_MAX_ENTRIES', 256))
+TRANSCODE_CACHE_MAX_BYTES = int(os.environ.get('TRANSCODE_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+
+# Stored uploads (reusable by upload_id) and their analysis: entries, bytes, age
+UPLOAD_STORE_MAX_ENTRIES = int(os.environ.get('UPLOAD_STORE_MAX_ENTRIES', 64))
+UPLOAD_STORE_MAX_BYTES = int(os.environ.get('UPLOAD_STORE_MAX_BYTES', 2 * 1024 * 1024 * 1024))
+UPLOAD_STORE_MAX_AGE = int(os.environ.get('UPLOAD_STORE_MAX_AGE', 24 * 3600))
+
+# Uploads up to UPLOAD_SPOOL_THRESHOLD seen once are kept in memory, up to
+# this many bytes in total, and only written to uploads/ when reused
+UPLOAD_MEMORY_MAX_BYTES = int(os.environ.get('UPLOAD_MEMORY_MAX_BYTES', 64 * 1024 * 1024))
+
+# /api/analyze resamples to this rate before framing (0 keeps the file's rate)
+ANALYSIS_SAMPLE_RATE = int(os.environ.get('ANALYSIS_SAMPLE_RATE', 11025))
+
+# Comma-separated endpoints to preload at startup (generate, remix, analyze
+# or all); empty keeps startup lazy and loads dependencies on first use
+WARMUP = os.environ.get('WARMUP', '')
+
+# Add a Server-Timing header to every response (clients can also ask per
+# request with an X-Timing header)
+SERVER_TIMING = os.environ.get('SERVER_TIMING', 'false').lower() == 'true'
+
+# Opt-in sampling profiler: requests slower than PROFILE_SLOW_THRESHOLD
+# seconds (or sent with X-Profile) get folded stacks written to PROFILE_FOLDER
+PROFILE_REQUESTS = os.environ.get('PROFILE_REQUESTS', 'false').lower() == 'true'
+PROFILE_SLOW_THRESHOLD = float(os.environ.get('PROFILE_SLOW_THRESHOLD', 1.0))
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL', 0.005))
+PROFILE_FOLDER = os.environ.get('PROFILE_FOLDER', 'profiles')
 
 # Set FFmpeg path explicitly
 FFMPEG_PATH = r"C:\Users\MANISH SHARMA\Downloads\ffmpeg-8.0-essentials_build\ffmpeg-8.0-essentials_build\bin\ffmpeg.exe"
@@ -49,8 +174,14 @@ def check_ffmpeg():
         print("  Or install via: choco install ffmpeg (Windows)")
         return False
 
-# Check FFmpeg on startup
-FFMPEG_AVAILABLE = check_ffmpeg()
+_ffmpeg_available = None
+
+def ffmpeg_available():
+    """Whether FFmpeg is usable; probed on first call rather than at import"""
+    global _ffmpeg_available
+    if _ffmpeg_available is None:
+        _ffmpeg_available = check_ffmpeg()
+    return _ffmpeg_available
 
 # Mood to musical parameters mapping
 MOOD_PRESETS = {
@@ -126,32 +257,275 @@ GENRE_PRESETS = {
     }
 }
 
-def generate_tone(frequency, duration, waveform='sine', sample_rate=44100):
-    """Generate a tone with specified waveform"""
-    duration_ms = int(duration * 1000)
+SAMPLE_RATE = 44100
+
+def poly_blep(phase, phase_step):
+    """Polynomial band-limited step residual for a jump at phase 0
+    
+    Subtracting this from a naive waveform that jumps down by 2 at phase 0
+    smooths the two samples around each jump, removing most of the
+    aliasing a hard edge folds back below Nyquist.
+    """
+    residual = np.zeros_like(phase)
+    
+    rising = phase < phase_step
+    x = phase[rising] / phase_step
+    residual[rising] = 2 * x - x * x - 1.0
+    
+    falling = phase > 1.0 - phase_step
+    x = (phase[falling] - 1.0) / phase_step
+    residual[falling] = x * x + 2 * x + 1.0
+    
+    return residual
+
+def render_waveform(frequency, num_samples, waveform='sine', sample_rate=SAMPLE_RATE):
+    """Render a waveform as a float32 NumPy buffer in the range [-1, 1]
     
-    if waveform == 'sine':
-        tone = Sine(frequency).to_audio_segment(duration=duration_ms)
-    elif waveform == 'square':
-        tone = Square(frequency).to_audio_segment(duration=duration_ms)
+    Square and sawtooth are band-limited with PolyBLEP, so they don't need
+    filtering afterwards to keep aliasing out of the audible range.
+    """
+    n = np.arange(num_samples, dtype=np.float64)
+    cycle_length = sample_rate / float(frequency)
+    
+    if waveform == 'square':
+        phase_step = float(frequency) / sample_rate
+        phase = (n * phase_step) % 1.0
+        samples = np.where(phase < 0.5, 1.0, -1.0)
+        # The falling edge sits half a cycle later: phase + 0.5, wrapped
+        falling_phase = phase + 0.5 * samples
+        samples += poly_blep(phase, phase_step)
+        samples -= poly_blep(falling_phase, phase_step)
     elif waveform == 'sawtooth':
-        tone = Sawtooth(frequency).to_audio_segment(duration=duration_ms)
+        phase_step = float(frequency) / sample_rate
+        phase = (n * phase_step) % 1.0
+        samples = 2 * phase - 1.0
+        samples -= poly_blep(phase, phase_step)
     elif waveform == 'triangle':
-        tone = Triangle(frequency).to_audio_segment(duration=duration_ms)
+        # Rising for the first half of each cycle, falling for the second
+        position = n % cycle_length
+        midpoint = cycle_length * 0.5
+        samples = np.where(position < midpoint,
+                           2 * position / midpoint - 1.0,
+                           1.0 - 2 * (position - midpoint) / (cycle_length - midpoint))
     else:
-        tone = Sine(frequency).to_audio_segment(duration=duration_ms)
+        samples = np.sin(2 * np.pi * frequency / sample_rate * n)
+    
+    return samples.astype(np.float32)
+
+def apply_fades(samples, fade_in_ms, fade_out_ms, sample_rate=SAMPLE_RATE):
+    """Apply linear fade in/out envelopes to a buffer in place"""
+    fade_in = min(int(sample_rate * fade_in_ms / 1000), len(samples))
+    fade_out = min(int(sample_rate * fade_out_ms / 1000), len(samples))
+    
+    if fade_in > 0:
+        samples[:fade_in] *= np.arange(fade_in, dtype=np.float32) / fade_in
+    if fade_out > 0:
+        samples[len(samples) - fade_out:] *= 1 - np.arange(fade_out, dtype=np.float32) / fade_out
+    
+    return samples
+
+def db_to_gain(db):
+    """Convert a dB change to a linear amplitude factor"""
+    return 10 ** (db / 20.0)
+
+class Score:
+    """Compact event list of notes, stored as parallel arrays
+    
+    Each event is (onset, duration, frequency, gain, voice) with times in
+    seconds, linear gain and an index into the voice table. Voices carry
+    the waveform and envelope so events stay five numbers each.
+    """
+    __slots__ = ('length', 'voices', 'onsets', 'durations', 'frequencies', 'gains', 'voice_ids')
+    
+    def __init__(self, length=0.0):
+        self.length = length
+        self.voices = []
+        self.onsets = array.array('d')
+        self.durations = array.array('d')
+        self.frequencies = array.array('d')
+        self.gains = array.array('d')
+        self.voice_ids = array.array('B')
+    
+    def add_voice(self, name, waveform='sine', fade_in=0, fade_out=0):
+        """Register a voice and return its index"""
+        self.voices.append({
+            'name': name,
+            'waveform': waveform,
+            'fade_in': fade_in,
+            'fade_out': fade_out
+        })
+        return len(self.voices) - 1
+    
+    def add_note(self, onset, duration, frequency, gain, voice):
+        """Append a note event"""
+        self.onsets.append(onset)
+        self.durations.append(duration)
+        self.frequencies.append(frequency)
+        self.gains.append(gain)
+        self.voice_ids.append(voice)
+    
+    def __len__(self):
+        return len(self.onsets)
+    
+    def events(self):
+        """Iterate over (onset, duration, frequency, gain, voice) tuples"""
+        return zip(self.onsets, self.durations, self.frequencies, self.gains, self.voice_ids)
+    
+    def to_dict(self):
+        """Plain representation for caching, diffing and JSON responses"""
+        return {
+            'length': self.length,
+            'voices': self.voices,
+            'events': [list(event) for event in self.events()]
+        }
+
+class NoteCache:
+    """Bounded LRU of rendered, enveloped note buffers
+    
+    Scales only span a few dozen pitches and rhythms a handful of lengths
+    per tempo, so most notes of a track (and of the next track) repeat.
+    Buffers are keyed by everything that shapes them except gain, and are
+    read-only so callers can't corrupt a shared entry.
+    """
+    
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+    
+    def tone(self, waveform, frequency, num_samples, fade_in, fade_out, sample_rate=SAMPLE_RATE):
+        """Return the enveloped tone, rendering it on a miss"""
+        key = (waveform, frequency, num_samples, fade_in, fade_out, sample_rate)
+        with self.lock:
+            tone = self.entries.get(key)
+            if tone is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return tone
+            self.misses += 1
+        
+        tone = render_waveform(frequency, num_samples, waveform, sample_rate)
+        apply_fades(tone, fade_in, fade_out, sample_rate)
+        tone.flags.writeable = False
+        
+        with self.lock:
+            if key not in self.entries and tone.nbytes <= self.max_bytes:
+                self.entries[key] = tone
+                self.total_bytes += tone.nbytes
+                while self.total_bytes > self.max_bytes:
+                    _, evicted = self.entries.popitem(last=False)
+                    self.total_bytes -= evicted.nbytes
+        return tone
+    
+    def clear(self):
+        """Drop every cached buffer"""
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+    
+    def stats(self):
+        """Hit/miss counters and current usage"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+note_cache = NoteCache(NOTE_CACHE_MAX_BYTES)
+
+def render_note(voice, duration, frequency, gain, sample_rate=SAMPLE_RATE):
+    """Render one score event with its voice's waveform and fades"""
+    tone = note_cache.tone(voice['waveform'], frequency, int(round(duration * sample_rate)),
+                           voice['fade_in'], voice['fade_out'], sample_rate)
+    return tone * np.float32(gain)
+
+def render_score(score, sample_rate=SAMPLE_RATE):
+    """Mix every voice of a score into one preallocated float32 buffer
+    
+    Notes running past the end of the score are cut off.
+    """
+    num_samples = int(round(score.length * sample_rate))
+    buffer = np.zeros(num_samples, dtype=np.float32)
+    
+    for onset, duration, frequency, gain, voice_id in score.events():
+        start = int(round(onset * sample_rate))
+        length = min(int(round(duration * sample_rate)), num_samples - start)
+        if length <= 0:
+            continue
+        
+        tone = render_note(score.voices[voice_id], duration, frequency, gain, sample_rate)
+        buffer[start:start + length] += tone[:length]
+    
+    return buffer
+
+def render_score_blocks(score, block_size=None, sample_rate=SAMPLE_RATE):
+    """Yield the mix of a score as consecutive float32 blocks
     
-    return tone
+    Notes are rendered in onset order into a carry buffer that only spans
+    the notes still sounding, so the first block is ready after rendering
+    just the notes that start in it. The blocks join up to render_score().
+    """
+    block_size = block_size or STREAM_BLOCK_SIZE
+    num_samples = int(round(score.length * sample_rate))
+    events = sorted(score.events(), key=lambda event: int(round(event[0] * sample_rate)))
+    carry = np.zeros(0, dtype=np.float32)
+    carry_start = 0
+    next_event = 0
+    
+    for block_start in range(0, num_samples, block_size):
+        block_end = min(block_start + block_size, num_samples)
+        
+        # Every note starting before block_end has been added once this loop ends
+        while next_event < len(events):
+            onset, duration, frequency, gain, voice_id = events[next_event]
+            start = int(round(onset * sample_rate))
+            if start >= block_end:
+                break
+            next_event += 1
+            length = min(int(round(duration * sample_rate)), num_samples - start)
+            if length <= 0:
+                continue
+            
+            tone = render_note(score.voices[voice_id], duration, frequency, gain, sample_rate)
+            offset = start - carry_start
+            if offset + length > len(carry):
+                carry = np.concatenate([carry, np.zeros(offset + length - len(carry), dtype=np.float32)])
+            carry[offset:offset + length] += tone[:length]
+        
+        block = carry[:block_end - carry_start]
+        if len(block) < block_end - block_start:
+            block = np.concatenate([block, np.zeros(block_end - block_start - len(block), dtype=np.float32)])
+        carry = carry[block_end - carry_start:]
+        carry_start = block_end
+        yield block
+
+# Frequencies of MIDI notes 0-127 (A4 = 440Hz), computed once
+NOTE_FREQUENCIES = tuple(440 * (2 ** ((midi_note - 69) / 12)) for midi_note in range(128))
 
 def note_to_frequency(note, octave=4):
     """Convert note number to frequency (A4 = 440Hz)"""
     # C4 is MIDI note 60
     midi_note = 60 + note + (octave - 4) * 12
-    frequency = 440 * (2 ** ((midi_note - 69) / 12))
-    return frequency
+    if 0 <= midi_note < len(NOTE_FREQUENCIES):
+        return NOTE_FREQUENCIES[midi_note]
+    return 440 * (2 ** ((midi_note - 69) / 12))
 
-def generate_melody(mood_preset, genre_preset, duration=10, tempo=120):
-    """Generate a melody based on mood and genre"""
+def generate_melody(mood_preset, genre_preset, duration=10, tempo=120, rng=None):
+    """Compose a melody based on mood and genre into a new Score
+    
+    Pass a seeded random.Random as rng to make the melody reproducible.
+    """
+    if rng is None:
+        rng = random.Random()
+    
     notes = mood_preset['notes']
     waveform = genre_preset['waveform']
     rhythm_pattern = genre_preset['rhythm_pattern']
@@ -159,9 +533,15 @@ def generate_melody(mood_preset, genre_preset, duration=10, tempo=120):
     # Calculate beat duration
     beat_duration = 60 / tempo  # seconds per beat
     
-    # Generate melody
-    melody = AudioSegment.silent(duration=0)
+    # Adjust volume based on energy
+    gain = db_to_gain(-20 + (mood_preset['energy'] * 15))
+    
+    score = Score()
+    voice = score.add_voice('melody', waveform, fade_in=50, fade_out=50)
     
+    # Notes and rests are laid end to end, so the write position only
+    # advances by what was actually played
+    position = 0
     current_time = 0
     pattern_index = 0
     
@@ -169,271 +549,2671 @@ def generate_melody(mood_preset, genre_preset, duration=10, tempo=120):
         # Check if we should play a note based on rhythm pattern
         if rhythm_pattern[pattern_index % len(rhythm_pattern)] == 1:
             # Choose a random note from the scale
-            note = random.choice(notes)
-            octave = random.choice([3, 4, 5])
+            note = rng.choice(notes)
+            octave = rng.choice([3, 4, 5])
             frequency = note_to_frequency(note, octave)
             
-            # Generate note
-            note_duration = beat_duration * random.choice([0.25, 0.5, 1.0])
-            tone = generate_tone(frequency, note_duration, waveform)
-            
-            # Apply envelope (fade in/out)
-            tone = tone.fade_in(50).fade_out(50)
-            
-            # Adjust volume based on energy
-            volume_adjustment = -20 + (mood_preset['energy'] * 15)
-            tone = tone + volume_adjustment
-            
-            melody = melody + tone
+            note_duration = int(beat_duration * rng.choice([0.25, 0.5, 1.0]) * 1000) / 1000
+            score.add_note(position, note_duration, frequency, gain, voice)
+            position += note_duration
         else:
             # Rest
-            rest_duration = int(beat_duration * 1000)
-            melody = melody + AudioSegment.silent(duration=rest_duration)
+            position += int(beat_duration * 1000) / 1000
         
         current_time += beat_duration
         pattern_index += 1
     
     # Trim to exact duration
-    melody = melody[:duration * 1000]
+    score.length = min(position, duration)
     
-    return melody
+    return score
 
-def add_bass_line(melody, mood_preset, genre_preset, tempo=120):
-    """Add a bass line to the melody"""
+def add_bass_line(score, mood_preset, genre_preset, tempo=120):
+    """Add a bass line voice to the score, covering its full length"""
     notes = mood_preset['notes']
     waveform = 'sine'  # Bass is usually sine wave
     
     beat_duration = 60 / tempo
-    duration = len(melody) / 1000  # Convert to seconds
+    voice = score.add_voice('bass', waveform, fade_in=100, fade_out=100)
+    
+    # Bass plays root notes in a low octave, quieter than the melody
+    frequency = note_to_frequency(notes[0], 2)
+    note_duration = int(beat_duration * 2 * 1000) / 1000  # Longer notes for bass
+    gain = db_to_gain(-10)
     
-    bass = AudioSegment.silent(duration=0)
     current_time = 0
+    while current_time < score.length:
+        score.add_note(current_time, note_duration, frequency, gain, voice)
+        current_time += note_duration
     
-    while current_time < duration:
-        # Bass plays root notes
-        note = notes[0]  # Root note
-        octave = 2  # Low octave for bass
-        frequency = note_to_frequency(note, octave)
+    return score
+
+# Block-processing stages. Audio is float32 (channels, frames); each stage
+# keeps its own state so a buffer can be processed whole or in blocks.
+
+class GainStage:
+    """Constant gain in dB, clipped like a 16-bit mix"""
+    
+    def __init__(self, db):
+        self.gain = db_to_gain(db)
+    
+    def process(self, block):
+        return np.clip(block * self.gain, -1.0, 1.0)
+    
+    def flush(self):
+        return None
+
+def rc_filter_sos(kind, cutoff, sample_rate, gain=1.0):
+    """pydub's first-order RC low/high-pass as one SOS section, gain folded into b"""
+    rc = 1.0 / (cutoff * 2 * np.pi)
+    dt = 1.0 / sample_rate
+    if kind == 'low':
+        alpha = dt / (rc + dt)
+        return np.array([[gain * alpha, 0.0, 0.0, 1.0, alpha - 1.0, 0.0]])
+    alpha = rc / (rc + dt)
+    return np.array([[gain * alpha, -gain * alpha, 0.0, 1.0, -alpha, 0.0]])
+
+class FilterStage:
+    """First-order RC low/high-pass with pydub's coefficients, run as a stateful sosfilt
+    
+    gain (linear) scales the output as part of the same pass. sos, if given,
+    is used instead (e.g. a compiled plan's) and already includes the gain.
+    The output is clipped like pydub's unless clip is False (e.g. after an
+    unclipped mix).
+    """
+    
+    def __init__(self, kind, cutoff, sample_rate, channels, gain=1.0, clip=True, sos=None):
+        self.sos = rc_filter_sos(kind, cutoff, sample_rate, gain) if sos is None else np.asarray(sos, dtype=np.float64)
+        self.kind = kind
+        self.channels = channels
+        self.clip = clip
+        self.zi = None
+    
+    def process(self, block):
+        if self.zi is None:
+            if self.kind == 'low':
+                # pydub starts the low-pass settled on the first sample
+                self.zi = signal.sosfilt_zi(self.sos)[:, np.newaxis, :] * block[np.newaxis, :, 0, np.newaxis]
+            else:
+                self.zi = np.zeros((self.sos.shape[0], self.channels, 2))
+        filtered, self.zi = signal.sosfilt(self.sos, block, axis=-1, zi=self.zi)
+        if self.clip:
+            filtered = np.clip(filtered, -1.0, 1.0)
+        return filtered.astype(np.float32)
+    
+    def flush(self):
+        return None
+
+class MultiTapDelayStage:
+    """Sparse FIR mixing delayed, attenuated copies of the input back in
+    
+    With keep_tail, flush() emits the last max-delay frames of echoes so
+    the output is that much longer than the input; otherwise the output
+    is cut at the input length like pydub's overlay.
+    """
+    
+    def __init__(self, taps, sample_rate, channels, keep_tail=True):
+        self.taps = [(int(sample_rate * delay_ms / 1000), db_to_gain(gain_db))
+                     for delay_ms, gain_db in taps]
+        self.max_delay = max(delay for delay, _ in self.taps)
+        self.history = np.zeros((channels, self.max_delay), dtype=np.float32)
+        self.keep_tail = keep_tail
+        self.tail_frames = self.max_delay if keep_tail else 0
+    
+    def process(self, block):
+        frames = block.shape[1]
+        padded = np.concatenate([self.history, block], axis=1)
+        out = block.copy()
+        for delay, gain in self.taps:
+            start = self.max_delay - delay
+            out += gain * padded[:, start:start + frames]
+        self.history = padded[:, -self.max_delay:]
+        return np.clip(out, -1.0, 1.0)
+    
+    def flush(self):
+        if not self.keep_tail:
+            return None
+        return self.process(np.zeros_like(self.history))
+
+class CompressorStage:
+    """Feed-forward RMS compressor following pydub's compress_dynamic_range
+    
+    The attack/release recurrence runs at a control rate of a quarter of
+    the attack window and the gain is interpolated per sample.
+    """
+    
+    def __init__(self, sample_rate, threshold=-20.0, ratio=4.0, attack=5.0, release=50.0):
+        self.threshold = db_to_gain(threshold)
+        self.ratio = ratio
+        self.look = max(int(sample_rate * attack / 1000), 1)
+        self.attack_frames = sample_rate * attack / 1000
+        self.release_frames = sample_rate * release / 1000
+        self.hop = max(self.look // 4, 1)
+        self.history = np.zeros(self.look)
+        self.attenuation = 0.0
+        self.pending = None
+    
+    def process(self, block):
+        # Work in whole hops so the control grid doesn't depend on block size
+        if self.pending is not None:
+            block = np.concatenate([self.pending, block], axis=1)
+        usable = block.shape[1] - block.shape[1] % self.hop
+        self.pending = block[:, usable:]
+        return self._compress(block[:, :usable])
+    
+    def flush(self):
+        if self.pending is None or self.pending.shape[1] == 0:
+            return None
+        block, self.pending = self.pending, None
+        return self._compress(block)
+    
+    def _compress(self, block):
+        frames = block.shape[1]
+        if frames == 0:
+            return block
+        
+        # Sliding mean square over the previous `look` frames, all channels
+        power = np.concatenate([self.history, np.mean(block.astype(np.float64) ** 2, axis=0)])
+        cumulative = np.concatenate([[0.0], np.cumsum(power)])
+        self.history = power[-self.look:]
         
-        note_duration = beat_duration * 2  # Longer notes for bass
-        tone = generate_tone(frequency, note_duration, waveform)
+        hop_starts = np.arange(0, frames, self.hop)
+        window_ends = hop_starts + self.look
+        rms = np.sqrt(np.maximum(cumulative[window_ends] - cumulative[window_ends - self.look], 0) / self.look)
         
-        # Bass is quieter
-        tone = tone - 10
-        tone = tone.fade_in(100).fade_out(100)
+        with np.errstate(divide='ignore'):
+            over_db = np.maximum(20 * np.log10(rms / self.threshold), 0)
+        max_attenuation = (1 - 1.0 / self.ratio) * over_db
         
-        bass = bass + tone
-        current_time += beat_duration * 2
+        levels = np.empty(len(hop_starts) + 1)
+        levels[0] = self.attenuation
+        attenuation = self.attenuation
+        for i, (level, limit) in enumerate(zip(rms, max_attenuation)):
+            steps = min(self.hop, frames - hop_starts[i])
+            if level > self.threshold and attenuation <= limit:
+                attenuation = min(attenuation + steps * limit / self.attack_frames, limit)
+            else:
+                attenuation = max(attenuation - steps * limit / self.release_frames, 0.0)
+            levels[i + 1] = attenuation
+        self.attenuation = attenuation
+        
+        positions = np.append(hop_starts, frames)
+        gain_db = np.interp(np.arange(frames), positions, levels)
+        return (block * db_to_gain(-gain_db)).astype(np.float32)
+
+def run_stages(blocks, stages, flush=True):
+    """Push blocks through a chain of stages, flushing each at the end
+    
+    Stages may hold frames back (resampling, whole-hop processing), so
+    empty blocks are dropped instead of being passed down the chain.
+    """
+    timer = current_timer()
+    
+    def push(block, chain):
+        for stage in chain:
+            if block.shape[1] == 0:
+                break
+            if timer is not None and getattr(stage, 'label', None):
+                start = time.perf_counter()
+                block = stage.process(block)
+                timer.add(stage.label, time.perf_counter() - start, block.nbytes)
+            else:
+                block = stage.process(block)
+        return block
     
-    # Trim to match melody length
-    bass = bass[:len(melody)]
+    for block in blocks:
+        block = push(block, stages)
+        if block.shape[1]:
+            yield block
     
-    return bass
+    if not flush:
+        return
+    
+    # Flushed tails still have to pass through the stages after them
+    for i, stage in enumerate(stages):
+        start = time.perf_counter()
+        tail = stage.flush()
+        if timer is not None and getattr(stage, 'label', None):
+            timer.add(stage.label, time.perf_counter() - start, 0 if tail is None else tail.nbytes)
+        if tail is None:
+            continue
+        tail = push(tail, stages[i + 1:])
+        if tail.shape[1]:
+            yield tail
 
-def apply_effects(audio, effects, mood_preset):
-    """Apply audio effects"""
-    result = audio
+def output_length(stages, frames):
+    """Frames a chain of length-preserving stages emits for frames of input
     
-    if 'reverb' in effects:
-        # Enhanced reverb with multiple delays
-        delay_times = [100, 200, 300]  # ms
-        for i, delay_time in enumerate(delay_times):
-            decay = 0.4 - (i * 0.1)
-            delayed = AudioSegment.silent(duration=delay_time) + audio
-            delayed = delayed - (10 + i * 5)  # Progressive volume reduction
-            result = result.overlay(delayed)
+    Only delay tails add length; stages that change duration (resampler,
+    phase vocoder) are not accounted for.
+    """
+    return frames + sum(getattr(stage, 'tail_frames', 0) for stage in stages)
+
+def process_buffer(samples, stages, block_size=None):
+    """Run a whole (channels, frames) buffer through stages block by block
+    
+    Working in blocks bounds the size of intermediate arrays such as the
+    phase vocoder's spectra.
+    """
+    block_size = block_size or STREAM_BLOCK_SIZE
+    if not stages:
+        return samples
+    
+    blocks = (samples[:, i:i + block_size] for i in range(0, samples.shape[1], block_size))
+    out = list(run_stages(blocks, stages))
+    if not out:
+        return np.zeros((samples.shape[0], 0), dtype=np.float32)
+    return np.concatenate(out, axis=1)
+
+class ResampleStage:
+    """Streaming windowed-sinc resampler
+    
+    step is the number of input frames consumed per output frame, so
+    step > 1 shortens (and raises) the audio. The kernel's cutoff follows
+    the lower of the two rates to avoid aliasing.
+    """
+    
+    def __init__(self, step, channels, half_width=8):
+        self.step = step
+        self.half_width = half_width
+        self.cutoff = min(1.0, 1.0 / step)
+        self.offsets = np.arange(1 - half_width, half_width + 1)
+        # Zero history so the first outputs have left neighbours
+        self.pending = np.zeros((channels, half_width), dtype=np.float32)
+        self.position = float(half_width)
+    
+    def _emit(self, limit):
+        """Interpolate every output position below limit (in pending frames)"""
+        count = max(int(np.ceil((limit - self.position) / self.step)), 0)
+        count -= int(count > 0 and self.position + self.step * (count - 1) >= limit)
+        if count <= 0:
+            return np.zeros((self.pending.shape[0], 0), dtype=np.float32)
+        
+        positions = self.position + self.step * np.arange(count)
+        base = np.floor(positions).astype(np.int64)
+        distance = self.offsets[np.newaxis, :] - (positions - base)[:, np.newaxis]
+        window = 0.5 * (1 + np.cos(np.pi * np.clip(distance / self.half_width, -1, 1)))
+        weights = self.cutoff * np.sinc(self.cutoff * distance) * window
+        weights /= weights.sum(axis=1, keepdims=True)
+        
+        taps = self.pending[:, base[:, np.newaxis] + self.offsets[np.newaxis, :]]
+        out = np.einsum('cnk,nk->cn', taps, weights.astype(np.float32))
+        
+        self.position += self.step * count
+        keep_from = max(int(self.position) - self.half_width + 1, 0)
+        self.pending = self.pending[:, keep_from:]
+        self.position -= keep_from
+        return out
+    
+    def process(self, block):
+        self.pending = np.concatenate([self.pending, block], axis=1)
+        # Positions need half_width frames of look-ahead
+        return self._emit(self.pending.shape[1] - self.half_width)
+    
+    def flush(self):
+        # Pad with silence so the last real frames get right neighbours
+        end = self.pending.shape[1]
+        self.pending = np.concatenate(
+            [self.pending, np.zeros((self.pending.shape[0], self.half_width), dtype=np.float32)], axis=1)
+        return self._emit(end)
+
+class PhaseVocoderStage:
+    """Streaming STFT phase vocoder: changes duration without changing pitch
+    
+    rate > 1 speeds up, rate < 1 slows down. All frames available in a
+    block are transformed in one batched FFT, channels included, and the
+    phase accumulator and overlap-add tail carry over to the next block.
+    gain (linear) is folded into the synthesis window.
+    """
+    
+    def __init__(self, rate, channels, n_fft=2048, hop=512, gain=1.0):
+        self.rate = rate
+        self.channels = channels
+        self.n_fft = n_fft
+        self.hop = hop
+        # Analysis runs in float64: phase errors accumulate over the whole track
+        self.window = signal.get_window('hann', n_fft)
+        self.synthesis_window = self.window * gain
+        self.expected = 2 * np.pi * hop * np.arange(n_fft // 2 + 1) / n_fft
+        
+        # Centre the first frame on the first sample, like librosa.stft
+        self.pending = np.zeros((channels, n_fft // 2), dtype=np.float32)
+        self.steps_done = 0
+        self.dropped = 0
+        self.phase = None
+        self.ola = np.zeros((channels, n_fft - hop), dtype=np.float32)
+        self.norm = np.zeros(n_fft - hop, dtype=np.float32)
+        self.skip = n_fft // 2
+        self.total_in = 0
+        self.emitted = 0
+    
+    def _overlap_add(self, frames):
+        """Overlap-add (..., count, n_fft) frames at hop spacing into a flat signal"""
+        count = frames.shape[-2]
+        ratio = self.n_fft // self.hop
+        blocks = np.zeros(frames.shape[:-2] + (count + ratio - 1, self.hop), dtype=np.float32)
+        parts = frames.reshape(frames.shape[:-1] + (ratio, self.hop))
+        for r in range(ratio):
+            blocks[..., r:r + count, :] += parts[..., r, :]
+        return blocks.reshape(frames.shape[:-2] + (-1,))
+    
+    def _synthesize(self):
+        available = (self.pending.shape[1] - self.n_fft) // self.hop + 1
+        
+        # Step positions come from the absolute step index so they don't
+        # depend on how the input was split into blocks. Each step needs
+        # its frame and the one after it.
+        estimate = max(int(np.ceil((available + self.dropped) / self.rate)) + 1 - self.steps_done, 0)
+        steps = (self.steps_done + np.arange(estimate)) * self.rate
+        first = np.floor(steps).astype(np.int64)
+        count = int(np.count_nonzero(first + 1 < available + self.dropped))
+        if count == 0:
+            return np.zeros((self.channels, 0), dtype=np.float32)
+        
+        steps = steps[:count]
+        first = first[:count]
+        alpha = (steps - first)[np.newaxis, :, np.newaxis]
+        first -= self.dropped
+        
+        # Batched STFT of every analysis frame these steps touch
+        views = np.lib.stride_tricks.sliding_window_view(self.pending, self.n_fft, axis=-1)
+        frames = views[:, first[0] * self.hop:(first[-1] + 1) * self.hop + 1:self.hop]
+        spectrum = np.fft.rfft(frames * self.window, axis=-1)
+        current = spectrum[:, first - first[0]]
+        following = spectrum[:, first - first[0] + 1]
+        
+        magnitude = (1 - alpha) * np.abs(current) + alpha * np.abs(following)
+        if self.phase is None:
+            self.phase = np.angle(current[:, 0])
+        
+        # Phase advance per step: expected advance plus the wrapped deviation
+        deviation = np.angle(following) - np.angle(current) - self.expected
+        deviation -= 2 * np.pi * np.round(deviation / (2 * np.pi))
+        # Wrapped so the running sum stays small enough for float64 precision
+        advance = np.mod(self.expected + deviation, 2 * np.pi)
+        phases = np.cumsum(advance, axis=1)
+        phases = self.phase[:, np.newaxis, :] + np.concatenate(
+            [np.zeros_like(phases[:, :1]), phases[:, :-1]], axis=1)
+        self.phase = np.mod(phases[:, -1] + advance[:, -1], 2 * np.pi)
+        
+        synthesis = np.fft.irfft(magnitude * np.exp(1j * phases), n=self.n_fft, axis=-1)
+        synthesis = (synthesis * self.synthesis_window).astype(np.float32)
+        
+        out = self._overlap_add(synthesis)
+        norm = self._overlap_add(np.broadcast_to(self.window ** 2, (count, self.n_fft)).astype(np.float32))
+        tail = self.n_fft - self.hop
+        out[:, :tail] += self.ola
+        norm[:tail] += self.norm
+        self.ola = out[:, -tail:].copy()
+        self.norm = norm[-tail:].copy()
+        
+        ready = count * self.hop
+        out = out[:, :ready]
+        norm = norm[:ready]
+        out = np.where(norm > 1e-8, out / np.maximum(norm, 1e-8), out)
+        
+        # Drop analysis frames no later step needs
+        self.steps_done += count
+        next_frame = int(np.floor(self.steps_done * self.rate))
+        self.pending = self.pending[:, (next_frame - self.dropped) * self.hop:]
+        self.dropped = next_frame
+        return out
+    
+    def _trim(self, out, limit=None):
+        skip = min(self.skip, out.shape[1])
+        out = out[:, skip:]
+        self.skip -= skip
+        if limit is not None:
+            out = out[:, :max(limit - self.emitted, 0)]
+        self.emitted += out.shape[1]
+        return out
+    
+    def process(self, block):
+        self.total_in += block.shape[1]
+        self.pending = np.concatenate([self.pending, block], axis=1)
+        return self._trim(self._synthesize())
+    
+    def flush(self):
+        target = int(round(self.total_in / self.rate))
+        padding = np.zeros((self.channels, self.n_fft + self.hop), dtype=np.float32)
+        self.pending = np.concatenate([self.pending, padding], axis=1)
+        out = self._trim(self._synthesize(), target)
+        if self.emitted < target:
+            out = np.concatenate(
+                [out, np.zeros((self.channels, target - self.emitted), dtype=np.float32)], axis=1)
+            self.emitted = target
+        return out
+
+class DelayStage:
+    """Delay the signal by a fixed number of frames"""
+    
+    def __init__(self, frames, channels):
+        self.pending = np.zeros((channels, frames), dtype=np.float32)
+    
+    def process(self, block):
+        self.pending = np.concatenate([self.pending, block], axis=1)
+        out = self.pending[:, :block.shape[1]]
+        self.pending = self.pending[:, block.shape[1]:]
+        return out
+    
+    def flush(self):
+        out, self.pending = self.pending, self.pending[:, :0]
+        return out
+
+layer_executor = None
+layer_executor_pid = None
+
+def _get_layer_executor():
+    """Thread pool shared by every ParallelMixStage, started on first use
+    
+    Forked job workers inherit the executor but not its threads, so each
+    process starts its own.
+    """
+    global layer_executor, layer_executor_pid
+    if layer_executor is None or layer_executor_pid != os.getpid():
+        layer_executor = ThreadPoolExecutor(max_workers=LAYER_WORKERS, thread_name_prefix='layer')
+        layer_executor_pid = os.getpid()
+    return layer_executor
+
+class ParallelMixStage:
+    """Run stage chains on copies of the input and sum them with the dry signal
+    
+    Branches are independent, so with several of them each block is
+    rendered on the layer thread pool. Branches may lag (phase vocoder,
+    resampler), so the dry signal and each branch's output are buffered
+    until every input is available for mixing. The sum is left unclipped
+    for the caller to normalize.
+    """
+    
+    def __init__(self, branches, channels):
+        self.branches = branches
+        self.channels = channels
+        self.dry = np.zeros((channels, 0), dtype=np.float32)
+        self.wet = [np.zeros((channels, 0), dtype=np.float32) for _ in branches]
+    
+    def _mix(self, final=False):
+        ready = self.dry.shape[1] if final else min([self.dry.shape[1]] + [w.shape[1] for w in self.wet])
+        out = self.dry[:, :ready].copy()
+        for i, wet in enumerate(self.wet):
+            length = min(ready, wet.shape[1])
+            out[:, :length] += wet[:, :length]
+            self.wet[i] = wet[:, ready:]
+        self.dry = self.dry[:, ready:]
+        return out
+    
+    def _run_branches(self, blocks, flush):
+        run = lambda branch: list(run_stages(blocks, branch, flush))
+        if len(self.branches) > 1 and LAYER_WORKERS > 1:
+            outputs = _get_layer_executor().map(run, self.branches)
+        else:
+            outputs = map(run, self.branches)
+        for i, wet in enumerate(outputs):
+            self.wet[i] = np.concatenate([self.wet[i]] + wet, axis=1)
+    
+    def process(self, block):
+        self.dry = np.concatenate([self.dry, block], axis=1)
+        self._run_branches([block], flush=False)
+        return self._mix()
+    
+    def flush(self):
+        self._run_branches([], flush=True)
+        return self._mix(final=True)
+
+# Loudness normalization: integrated loudness is metered as blocks pass
+# (ITU-R BS.1770 / EBU R128 gating), then gain and a true-peak limiter are
+# applied block by block, so neither step needs the whole track in memory
+
+def k_weighting_sos(sample_rate):
+    """BS.1770 K-weighting filter (high shelf, then RLB high-pass) as SOS"""
+    # +4 dB shelf above ~1.7 kHz modelling the head
+    k = np.tan(np.pi * 1681.974450955533 / sample_rate)
+    q = 0.7071752369554196
+    vh = db_to_gain(3.999843853973347)
+    vb = vh ** 0.4996667741545416
+    a0 = 1 + k / q + k * k
+    shelf = [(vh + vb * k / q + k * k) / a0, 2 * (k * k - vh) / a0, (vh - vb * k / q + k * k) / a0,
+             1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0]
+    
+    # Second-order high-pass at ~38 Hz
+    k = np.tan(np.pi * 38.13547087602444 / sample_rate)
+    q = 0.5003270373238773
+    a0 = 1 + k / q + k * k
+    highpass = [1.0, -2.0, 1.0, 1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0]
+    
+    return np.array([shelf, highpass])
+
+class LoudnessMeter:
+    """Pass-through stage measuring integrated loudness (LUFS) and sample peak
+    
+    K-weighted power is averaged per 100 ms step; the 400 ms gating blocks
+    overlap by 75%, so each is four consecutive steps and only one number
+    per step is kept, whatever the track length.
+    """
+    
+    def __init__(self, sample_rate, channels):
+        self.sos = k_weighting_sos(sample_rate)
+        self.zi = np.zeros((self.sos.shape[0], channels, 2))
+        self.step = int(round(sample_rate * 0.1))
+        self.pending = np.zeros(0)
+        self.steps = []
+        self.peak = 0.0
+    
+    def process(self, block):
+        if block.shape[1] == 0:
+            return block
+        weighted, self.zi = signal.sosfilt(self.sos, block, axis=-1, zi=self.zi)
+        power = np.concatenate([self.pending, np.sum(weighted * weighted, axis=0)])
+        complete = len(power) - len(power) % self.step
+        self.steps.extend(power[:complete].reshape(-1, self.step).mean(axis=1))
+        self.pending = power[complete:]
+        self.peak = max(self.peak, float(np.max(np.abs(block))))
+        return block
+    
+    def flush(self):
+        return None
+    
+    def integrated(self):
+        """Gated integrated loudness in LUFS, -inf for silence"""
+        steps = np.array(self.steps)
+        if len(steps) >= 4:
+            blocks = np.convolve(steps, np.full(4, 0.25), mode='valid')
+        elif len(steps) or len(self.pending):
+            # Shorter than one gating block: mean power over every sample
+            total = steps.sum() * self.step + self.pending.sum()
+            blocks = np.array([total / (len(steps) * self.step + len(self.pending))])
+        else:
+            return float('-inf')
+        
+        with np.errstate(divide='ignore'):
+            loudness = -0.691 + 10 * np.log10(blocks)
+        gated = blocks[loudness > -70.0]
+        if len(gated) == 0:
+            return float('-inf')
+        relative = -0.691 + 10 * np.log10(np.mean(gated)) - 10.0
+        gated = blocks[loudness > max(relative, -70.0)]
+        return float(-0.691 + 10 * np.log10(np.mean(gated)))
+
+def loudness_gain_db(loudness):
+    """Gain taking a measured integrated loudness to TARGET_LOUDNESS"""
+    if not np.isfinite(loudness):
+        return 0.0
+    return min(TARGET_LOUDNESS - loudness, LOUDNESS_MAX_GAIN)
+
+def sliding_min(values, window):
+    """Minimum of every window-long run of values in O(n) (van Herk/Gil-Werman)"""
+    count = len(values) - window + 1
+    padded = np.full(-(-len(values) // window) * window, np.inf)
+    padded[:len(values)] = values
+    runs = padded.reshape(-1, window)
+    prefix = np.minimum.accumulate(runs, axis=1).ravel()
+    suffix = np.minimum.accumulate(runs[:, ::-1], axis=1)[:, ::-1].ravel()
+    return np.minimum(suffix[:count], prefix[window - 1:window - 1 + count])
+
+class TruePeakLimiterStage:
+    """Gain followed by a look-ahead limiter on true (inter-sample) peaks
+    
+    Peaks between samples are found with a 4x polyphase interpolator. The
+    gain each one needs to stay under the ceiling is held for hold_ms and
+    ramped in over the look-ahead, so it is fully applied when the peak
+    arrives. Audio is delayed internally and the delay is flushed out, so
+    the output is exactly as long as the input.
+    """
+    
+    oversample = 4
+    taps_per_phase = 25
+    
+    def __init__(self, gain_db, ceiling_db, sample_rate, channels, lookahead_ms=5, hold_ms=50):
+        self.gain = np.float32(db_to_gain(gain_db))
+        self.ceiling = db_to_gain(ceiling_db)
+        self.channels = channels
+        
+        # Odd-length prototype, so phase 0 reproduces the input samples
+        length = self.oversample * (self.taps_per_phase - 1) + 1
+        prototype = signal.firwin(length, 1.0 / self.oversample) * self.oversample
+        prototype = np.append(prototype, np.zeros(self.oversample - 1))
+        self.phases = [prototype[p::self.oversample] for p in range(self.oversample)]
+        self.zi = [np.zeros((channels, self.taps_per_phase - 1)) for _ in self.phases]
+        # Interpolating input frame n completes the peak of interval [n - delay, n - delay + 1)
+        self.delay = (length - 1) // (2 * self.oversample)
+        
+        self.lookahead = max(int(sample_rate * lookahead_ms / 1000), 1)
+        self.hold = int(sample_rate * hold_ms / 1000)
+        self.received = 0
+        self.emitted = 0
+        self.audio = np.zeros((channels, 0), dtype=np.float32)
+        self.last_peak = 0.0
+        # Gain each frame needs, from lookahead + hold frames before the next
+        # frame to emit (frames before the track need none)
+        self.required = np.ones(self.lookahead + self.hold)
+    
+    def _interval_peaks(self, block):
+        """Oversampled peak of each interval completed by block"""
+        peaks = np.zeros(block.shape[1])
+        for i, phase in enumerate(self.phases):
+            interpolated, self.zi[i] = signal.lfilter(phase, 1.0, block, axis=-1, zi=self.zi[i])
+            peaks = np.maximum(peaks, np.abs(interpolated).max(axis=0))
+        return peaks
+    
+    def process(self, block):
+        block = block * self.gain
+        self.audio = np.concatenate([self.audio, block], axis=1)
+        peaks = self._interval_peaks(block)
+        
+        # The first delay frames complete intervals before the track starts
+        first = self.received - self.delay
+        self.received += block.shape[1]
+        if first < 0:
+            peaks = peaks[-first:]
+        
+        # A frame touches the intervals on both sides of it
+        if len(peaks):
+            touching = np.maximum(peaks, np.concatenate([[self.last_peak], peaks[:-1]]))
+            self.last_peak = peaks[-1]
+            self.required = np.concatenate(
+                [self.required, np.minimum(1.0, self.ceiling / np.maximum(touching, 1e-9))])
+        
+        # Emit every frame whose look-ahead window is complete
+        count = max(self.received - self.delay, 0) - self.lookahead - self.emitted
+        if count <= 0:
+            return np.zeros((self.channels, 0), dtype=np.float32)
+        
+        window = self.lookahead + 1
+        held = sliding_min(self.required[:count + 2 * self.lookahead + self.hold], self.hold + window)
+        ramp = np.cumsum(np.concatenate([[0.0], held]))
+        gain = (ramp[window:] - ramp[:-window]) / window
+        
+        out = self.audio[:, :count] * gain.astype(np.float32)
+        self.audio = self.audio[:, count:]
+        self.required = self.required[count:]
+        self.emitted += count
+        return out
+    
+    def flush(self):
+        # Push silence through until every real frame has been emitted
+        total, emitted = self.received, self.emitted
+        out = self.process(np.zeros((self.channels, self.delay + self.lookahead + 1), dtype=np.float32))
+        return out[:, :total - emitted]
+
+def normalize_loudness(samples, sample_rate, loudness=None):
+    """Bring a (channels, frames) buffer to TARGET_LOUDNESS under TRUE_PEAK_CEILING
+    
+    Pass loudness when it was metered while the buffer was produced to
+    skip the metering pass. Returns (samples, loudness before gain).
+    """
+    if loudness is None:
+        meter = LoudnessMeter(sample_rate, samples.shape[0])
+        process_buffer(samples, [meter])
+        loudness = meter.integrated()
+    limiter = TruePeakLimiterStage(loudness_gain_db(loudness), TRUE_PEAK_CEILING,
+                                   sample_rate, samples.shape[0])
+    return process_buffer(samples, [limiter]), loudness
+
+def semitones_to_ratio(semitones):
+    """Frequency ratio for a pitch change in semitones"""
+    return 2 ** (semitones / 12.0)
+
+def time_stretch_stages(rate, channels, gain=1.0):
+    """Stages changing tempo by rate (>1 faster) while keeping pitch"""
+    if rate == 1.0:
+        return []
+    return [PhaseVocoderStage(rate, channels, gain=gain)]
+
+class PitchShiftStage:
+    """Phase vocoder stretch followed by resampling back to the input length
+    
+    The vocoder stretches by the pitch ratio and the resampler then plays
+    that back at the original duration, raising the pitch. Rounding in the
+    two steps can leave the output a frame off, so flush pads or trims the
+    total to exactly the number of frames that went in.
+    """
+    
+    def __init__(self, semitones, channels):
+        ratio = semitones_to_ratio(semitones)
+        self.stages = [PhaseVocoderStage(1.0 / ratio, channels), ResampleStage(ratio, channels)]
+        self.channels = channels
+        self.total_in = 0
+        self.emitted = 0
+    
+    def _limit(self, blocks):
+        out = np.concatenate([np.zeros((self.channels, 0), dtype=np.float32)] + list(blocks), axis=1)
+        out = out[:, :max(self.total_in - self.emitted, 0)]
+        self.emitted += out.shape[1]
+        return out
+    
+    def process(self, block):
+        self.total_in += block.shape[1]
+        return self._limit(run_stages([block], self.stages, flush=False))
+    
+    def flush(self):
+        out = self._limit(run_stages([], self.stages))
+        missing = self.total_in - self.emitted
+        if missing > 0:
+            out = np.concatenate([out, np.zeros((self.channels, missing), dtype=np.float32)], axis=1)
+            self.emitted += missing
+        return out
+
+def pitch_shift_stages(semitones, channels):
+    """Stages changing pitch while keeping duration"""
+    if semitones == 0:
+        return []
+    return [PitchShiftStage(semitones, channels)]
+
+def build_effect_stages(effects, mood_preset, sample_rate, channels, keep_tail=True):
+    """Build the stage chain for a genre's effect names"""
+    stages = []
     
+    # Reverb and echo taps all read the dry signal, so they form one FIR
+    taps = []
+    if 'reverb' in effects:
+        taps += [(100, -10), (200, -15), (300, -20)]
     if 'delay' in effects:
-        # Echo effect
-        delay_time = 400
-        delayed = AudioSegment.silent(duration=delay_time) + audio
-        delayed = delayed - 12
-        result = result.overlay(delayed)
+        taps.append((400, -12))
+    if taps:
+        stages.append(MultiTapDelayStage(taps, sample_rate, channels, keep_tail))
     
     if 'filter' in effects:
         # Brightness-based filtering
-        brightness = mood_preset['brightness']
-        if brightness < 0.5:
-            result = result.low_pass_filter(3000)
+        if mood_preset['brightness'] < 0.5:
+            stages.append(FilterStage('low', 3000, sample_rate, channels))
         else:
-            result = result.high_pass_filter(100)
+            stages.append(FilterStage('high', 100, sample_rate, channels))
     
     if 'distortion' in effects:
         # Simulate distortion by boosting and compressing
-        result = result + 10  # Boost
-        result = result.compress_dynamic_range(threshold=-20.0, ratio=4.0)
+        stages.append(GainStage(10))
+        stages.append(CompressorStage(sample_rate))
     
-    return result
+    return stages
 
-def pitch_shift_audio(audio, semitones):
-    """Shift pitch of audio by semitones using frame rate manipulation"""
-    if semitones == 0:
-        return audio
+def apply_effects(samples, effects, mood_preset, sample_rate=SAMPLE_RATE, keep_tail=True):
+    """Apply audio effects to a float32 (channels, frames) buffer
+    
+    Reverb and delay tails are kept, so the result is up to 400 ms longer
+    than the input unless keep_tail is False.
+    """
+    stages = build_effect_stages(effects, mood_preset, sample_rate, samples.shape[0], keep_tail)
+    return process_buffer(samples, stages)
+
+def pitch_shift(samples, semitones):
+    """Shift the pitch of a (channels, frames) buffer, keeping its duration"""
+    return process_buffer(samples, pitch_shift_stages(semitones, samples.shape[0]))
+
+def time_stretch(samples, rate):
+    """Change the tempo of a (channels, frames) buffer by rate, keeping its pitch"""
+    return process_buffer(samples, time_stretch_stages(rate, samples.shape[0]))
+
+class FeatureAccumulator:
+    """Running energy, zero-crossing and range statistics over interleaved samples"""
+    
+    def __init__(self):
+        self.count = 0
+        self.sum_squares = 0.0
+        self.crossings = 0.0
+        self.peak = 0.0
+        self.minimum = 0.0
+        self.maximum = 0.0
+        self.last_sign = None
     
-    # Calculate new frame rate (pitch shift)
-    shift_factor = 2 ** (semitones / 12.0)
-    new_frame_rate = int(audio.frame_rate * shift_factor)
+    def add(self, block):
+        samples = block.T.reshape(-1).astype(np.float64)
+        if samples.size == 0:
+            return
+        signs = np.sign(samples)
+        if self.last_sign is not None:
+            signs = np.concatenate([[self.last_sign], signs])
+        self.crossings += np.sum(np.abs(np.diff(signs)))
+        self.last_sign = signs[-1]
+        
+        self.count += samples.size
+        self.sum_squares += np.sum(samples ** 2)
+        self.peak = max(self.peak, np.max(np.abs(samples)))
+        self.minimum = min(self.minimum, np.min(samples))
+        self.maximum = max(self.maximum, np.max(samples))
     
-    # Apply pitch shift
-    shifted = audio._spawn(audio.raw_data, overrides={'frame_rate': new_frame_rate})
-    shifted = shifted.set_frame_rate(audio.frame_rate)
+    def features(self):
+        peak = self.peak or 1.0
+        count = self.count or 1
+        return {
+            'energy': float(np.sqrt(self.sum_squares / count) / peak),
+            'brightness': float(self.crossings / (2 * count)),
+            'dynamic_range': float((self.maximum - self.minimum) / peak)
+        }
+
+def analyze_audio_features(samples, block_size=None):
+    """Analyze a float32 (channels, frames) buffer to extract musical features
     
-    return shifted
+    The buffer is read through block views, so no full-size temporaries
+    are made.
+    """
+    block_size = block_size or STREAM_BLOCK_SIZE
+    features = FeatureAccumulator()
+    for i in range(0, samples.shape[1], block_size):
+        features.add(samples[:, i:i + block_size])
+    return features.features()
 
-def time_stretch_audio(audio, rate):
-    """Stretch or compress audio duration without changing pitch"""
-    if rate == 1.0:
-        return audio
+# Track analysis for /api/analyze: one mixdown, one resample and one framed
+# STFT, with every feature computed on whole arrays of frames
+
+ANALYSIS_FRAME_SIZE = 1024
+ANALYSIS_HOP_SIZE = 256
+ANALYSIS_BATCH_FRAMES = 4096
+
+def frame_signal(x, frame_size, hop_size):
+    """Strided (frames, frame_size) view of a 1-D signal; no data is copied"""
+    if len(x) < frame_size:
+        x = np.pad(x, (0, frame_size - len(x)))
+    return np.lib.stride_tricks.sliding_window_view(x, frame_size)[::hop_size]
+
+def framed_sums(values, frame_size, hop_size, count):
+    """Sum of values over each of count frames, from one cumulative sum"""
+    totals = np.concatenate([[0.0], np.cumsum(values, dtype=np.float64)])
+    starts = np.minimum(np.arange(count) * hop_size, len(values))
+    ends = np.minimum(starts + frame_size, len(values))
+    return totals[ends] - totals[starts]
+
+def spectral_features(frames, sample_rate):
+    """Per-frame spectral centroid (Hz) and onset strength from a batched STFT
+    
+    Frames are transformed in batches so the complex spectrum of a long
+    track never has to exist all at once. Onset strength is the mean
+    positive change in log magnitude from the previous frame.
+    """
+    count, frame_size = frames.shape
+    window = signal.get_window('hann', frame_size).astype(np.float32)
+    freqs = np.fft.rfftfreq(frame_size, 1.0 / sample_rate).astype(np.float32)
+    centroid = np.zeros(count)
+    onset = np.zeros(count)
+    previous = None
     
-    # Export to numpy for processing
-    samples = np.array(audio.get_array_of_samples())
+    for start in range(0, count, ANALYSIS_BATCH_FRAMES):
+        magnitude = np.abs(np.fft.rfft(frames[start:start + ANALYSIS_BATCH_FRAMES] * window, axis=1))
+        end = start + len(magnitude)
+        
+        total = magnitude.sum(axis=1)
+        np.divide(magnitude @ freqs, total, out=centroid[start:end], where=total > 0)
+        
+        log_magnitude = np.log1p(magnitude)
+        head = log_magnitude[:1] if previous is None else previous
+        flux = np.diff(np.concatenate([head, log_magnitude]), axis=0)
+        onset[start:end] = np.maximum(flux, 0).mean(axis=1)
+        previous = log_magnitude[-1:]
+    
+    return centroid, onset
+
+def estimate_tempo(onset_envelope, frame_rate, min_bpm=60, max_bpm=200,
+                   min_prominence=8.0, min_confidence=0.05):
+    """Tempo in BPM from the autocorrelation of an onset envelope, or 0.0 if there is no clear beat
     
-    # Simple time stretching using interpolation
-    original_length = len(samples)
-    new_length = int(original_length / rate)
+    Onset peaks must stand out from the envelope's floor: the 99th
+    percentile's height above the 10th has to be min_prominence times the
+    median's. Between min_bpm and max_bpm, beats fill more than 1% and less
+    than half of the frames, so this doesn't depend on the tempo. Steady
+    tones and noise stay below 5, beats over a noise floor score above 14.
+    The chosen autocorrelation peak must also reach min_confidence of lag 0.
+    """
+    envelope = onset_envelope - onset_envelope.mean()
+    if len(envelope) < 2 or not np.any(envelope):
+        return 0.0
+    floor, median, peak = np.percentile(onset_envelope, [10, 50, 99])
+    if peak - floor <= min_prominence * (median - floor):
+        return 0.0
     
-    # Resample
-    indices = np.linspace(0, original_length - 1, new_length)
-    stretched_samples = np.interp(indices, np.arange(original_length), samples)
+    size = 2 ** int(np.ceil(np.log2(2 * len(envelope))))
+    spectrum = np.fft.rfft(envelope, size)
+    autocorrelation = np.fft.irfft(spectrum * np.conj(spectrum), size)[:len(envelope)]
     
-    # Convert back to AudioSegment
-    stretched_samples = stretched_samples.astype(np.int16)
-    stretched = audio._spawn(stretched_samples.tobytes())
+    lags = np.arange(1, len(autocorrelation) - 1)
+    bpm = 60.0 * frame_rate / lags
+    # A log-normal weight around 120 BPM damps half/double-tempo errors
+    score = autocorrelation[lags] * np.exp(-0.5 * np.log2(bpm / 120.0) ** 2)
+    score[(bpm < min_bpm) | (bpm > max_bpm)] = -np.inf
+    if not np.isfinite(score).any():
+        return 0.0
+    lag = lags[np.argmax(score)]
+    if autocorrelation[lag] <= min_confidence * autocorrelation[0]:
+        return 0.0
     
-    return stretched
+    # Parabolic interpolation between neighbouring lags
+    left, centre, right = autocorrelation[lag - 1:lag + 2]
+    curvature = left - 2 * centre + right
+    offset = 0.5 * (left - right) / curvature if curvature < 0 else 0.0
+    return float(60.0 * frame_rate / (lag + offset))
 
-def analyze_audio_features(audio):
-    """Analyze audio to extract musical features"""
-    # Convert to numpy array
-    samples = np.array(audio.get_array_of_samples(), dtype=np.float32)
-    samples = samples / np.max(np.abs(samples))  # Normalize
+def analyze_track(samples, sample_rate, analysis_rate=None):
+    """Vectorized tempo, loudness and timbre analysis of a (channels, frames) buffer
     
-    # Calculate features
-    rms_energy = np.sqrt(np.mean(samples ** 2))
-    zero_crossing_rate = np.sum(np.abs(np.diff(np.sign(samples)))) / (2 * len(samples))
+    Channels are mixed down and, when analysis_rate is below the file's
+    rate, resampled before framing so long tracks stay fast. Silent input
+    gives zeros rather than NaNs.
+    """
+    analysis_rate = ANALYSIS_SAMPLE_RATE if analysis_rate is None else analysis_rate
+    channels, length = samples.shape
     
-    # Estimate tempo from energy peaks
-    frame_size = 2048
-    hop_size = 512
-    energy_frames = []
+    # Level statistics over the original samples, per channel row
+    maximum = float(samples.max(initial=0.0))
+    minimum = float(samples.min(initial=0.0))
+    peak = max(maximum, -minimum)
+    sum_squares = sum(float(np.dot(row, row)) for row in samples)
     
-    for i in range(0, len(samples) - frame_size, hop_size):
-        frame = samples[i:i + frame_size]
-        energy_frames.append(np.sum(frame ** 2))
+    mono = samples[0] if channels == 1 else samples.mean(axis=0, dtype=np.float32)
+    rate = sample_rate
+    if analysis_rate and analysis_rate < sample_rate:
+        divisor = np.gcd(analysis_rate, sample_rate)
+        mono = signal.resample_poly(mono, analysis_rate // divisor, sample_rate // divisor).astype(np.float32)
+        rate = analysis_rate
     
-    energy_frames = np.array(energy_frames)
+    frames = frame_signal(mono, ANALYSIS_FRAME_SIZE, ANALYSIS_HOP_SIZE)
+    count = len(frames)
+    rms = np.sqrt(framed_sums(np.square(mono), ANALYSIS_FRAME_SIZE, ANALYSIS_HOP_SIZE, count)
+                  / ANALYSIS_FRAME_SIZE)
+    crossings = np.signbit(mono[1:]) != np.signbit(mono[:-1])
+    zcr = framed_sums(crossings, ANALYSIS_FRAME_SIZE - 1, ANALYSIS_HOP_SIZE, count) / ANALYSIS_FRAME_SIZE
+    centroid, onset = spectral_features(frames, rate)
+    
+    # Loud frames dominate the averages; silence doesn't drag them down
+    weights = rms if rms.sum() > 0 else None
+    mean_centroid = float(np.average(centroid, weights=weights)) if count else 0.0
     
     return {
-        'energy': float(rms_energy),
-        'brightness': float(zero_crossing_rate),
-        'dynamic_range': float(np.max(samples) - np.min(samples))
+        'energy': float(np.sqrt(sum_squares / max(channels * length, 1)) / peak) if peak > 0 else 0.0,
+        'dynamic_range': float((maximum - minimum) / peak) if peak > 0 else 0.0,
+        # Centroid on a log scale: 500 Hz and below is 0, 4 kHz and above is 1
+        'brightness': float(np.clip(np.log2(max(mean_centroid, 1.0) / 500.0) / 3.0, 0.0, 1.0)),
+        'spectral_centroid': mean_centroid,
+        'zero_crossing_rate': float(zcr.mean()) if count else 0.0,
+        'onset_strength': float(onset.mean()) if count else 0.0,
+        'tempo': round(estimate_tempo(onset, rate / ANALYSIS_HOP_SIZE), 1),
+        'duration': length / sample_rate,
+        'analysis_rate': rate
     }
 
-def intelligent_mood_transform(audio, source_mood, target_mood, mood_presets):
-    """Transform audio from one mood to another using AI-like processing"""
-    source_preset = mood_presets[source_mood]
-    target_preset = mood_presets[target_mood]
-    
-    result = audio
+def compile_mood_transform(source_preset, target_preset, sample_rate):
+    """Plan moving audio from one mood preset towards another
     
+    The energy gain rides on the first pass over the audio (the filter
+    when there is one, else the time stretch), so a transform is at most
+    two passes and usually one. Plans are plain data, so they can be
+    cached and served as JSON.
+    """
     # Adjust energy (volume and dynamics)
     energy_diff = target_preset['energy'] - source_preset['energy']
-    if energy_diff > 0:
-        result = result + (energy_diff * 10)  # Boost
-    else:
-        result = result + (energy_diff * 10)  # Reduce
+    gain_db = energy_diff * 10
     
     # Adjust brightness (filtering)
     brightness_diff = target_preset['brightness'] - source_preset['brightness']
+    filter_spec = None
     if brightness_diff > 0.2:
         # Make brighter - high-pass filter
-        result = result.high_pass_filter(200)
+        filter_spec = {'kind': 'high', 'cutoff': 200}
     elif brightness_diff < -0.2:
         # Make darker - low-pass filter
-        result = result.low_pass_filter(4000)
+        filter_spec = {'kind': 'low', 'cutoff': 4000}
     
     # Adjust tempo if needed
     source_tempo_avg = sum(source_preset['tempo_range']) / 2
     target_tempo_avg = sum(target_preset['tempo_range']) / 2
     tempo_ratio = target_tempo_avg / source_tempo_avg
+    if abs(tempo_ratio - 1.0) <= 0.1:
+        tempo_ratio = None
     
-    if abs(tempo_ratio - 1.0) > 0.1:
-        # Apply tempo change
-        new_frame_rate = int(result.frame_rate * tempo_ratio)
-        result = result._spawn(result.raw_data, overrides={'frame_rate': new_frame_rate})
-        result = result.set_frame_rate(44100)
-    
-    return result
-
-def add_harmony(audio, harmony_type='third'):
-    """Add harmonic layer to audio"""
-    if harmony_type == 'third':
-        # Add major third (4 semitones up)
-        harmony = pitch_shift_audio(audio, 4)
-    elif harmony_type == 'fifth':
-        # Add perfect fifth (7 semitones up)
-        harmony = pitch_shift_audio(audio, 7)
-    elif harmony_type == 'octave':
-        # Add octave
-        harmony = pitch_shift_audio(audio, 12)
-    else:
-        return audio
+    chain = []
+    if filter_spec is not None:
+        filter_spec['sos'] = rc_filter_sos(filter_spec['kind'], filter_spec['cutoff'], sample_rate,
+                                           db_to_gain(gain_db)).tolist()
+        chain.append('filter')
+    if tempo_ratio is not None:
+        chain.append('time_stretch')
+    if not chain and gain_db:
+        chain.append('gain')
     
-    # Mix with original (harmony quieter)
-    harmony = harmony - 8
-    result = audio.overlay(harmony)
+    return {
+        'sample_rate': sample_rate,
+        'gain_db': gain_db,
+        'filter': filter_spec,
+        'tempo_ratio': tempo_ratio,
+        'chain': chain
+    }
+
+# Compiled plans by (source mood, target mood, sample rate); SAMPLE_RATE
+# plans are built at startup, other rates on first use
+mood_transform_plans = {}
+
+def mood_transform_plan(source_mood, target_mood, sample_rate=SAMPLE_RATE, cache=True):
+    """Plan for a pair of MOOD_PRESETS names, compiled on first use unless cache is False"""
+    key = (source_mood, target_mood, sample_rate)
+    plan = mood_transform_plans.get(key)
+    if plan is None:
+        plan = dict(compile_mood_transform(MOOD_PRESETS[source_mood], MOOD_PRESETS[target_mood], sample_rate),
+                    source=source_mood, target=target_mood)
+        if cache:
+            mood_transform_plans[key] = plan
+    return plan
+
+# Every preset pair at the default rate, so requests only look plans up
+mood_transform_plans.update({
+    (source, target, SAMPLE_RATE): mood_transform_plan(source, target, cache=False)
+    for source in MOOD_PRESETS for target in MOOD_PRESETS
+})
+
+def plan_stages(plan, channels):
+    """Stage chain running a compiled mood-transform plan, filtering with its own coefficients"""
+    gain = db_to_gain(plan['gain_db'])
+    if 'filter' in plan['chain']:
+        spec = plan['filter']
+        stages = [FilterStage(spec['kind'], spec['cutoff'], plan['sample_rate'], channels, sos=spec['sos'])]
+        gain = 1.0
+    elif plan['chain'] == ['gain']:
+        return [GainStage(plan['gain_db'])]
+    else:
+        stages = []
     
-    return result
+    if plan['tempo_ratio'] is not None:
+        stages += time_stretch_stages(plan['tempo_ratio'], channels, gain)
+    return stages
+
+def mood_transform_stages(source_preset, target_preset, sample_rate, channels):
+    """Stages moving audio from one mood preset towards another"""
+    return plan_stages(compile_mood_transform(source_preset, target_preset, sample_rate), channels)
 
-def create_layered_mix(audio, layers_config):
-    """Create layered mix with multiple effects"""
-    result = audio
+# Harmony intervals in semitones: major third, perfect fifth, octave
+HARMONY_INTERVALS = {
+    'third': 4,
+    'fifth': 7,
+    'octave': 12
+}
+
+def harmony_stages(harmony_type, channels):
+    """Branch rendering the harmony layer from the dry signal"""
+    return pitch_shift_stages(HARMONY_INTERVALS[harmony_type], channels) + [GainStage(-8)]
+
+def layer_stages(layer, sample_rate, channels):
+    """Branch rendering one layer of a layered mix from the dry signal
     
-    for layer in layers_config:
-        layer_audio = audio
-        
-        # Apply layer-specific transformations
-        if 'pitch_shift' in layer:
-            layer_audio = pitch_shift_audio(layer_audio, layer['pitch_shift'])
-        
-        if 'volume' in layer:
-            layer_audio = layer_audio + layer['volume']
-        
-        if 'delay' in layer:
-            delay_ms = layer['delay']
-            layer_audio = AudioSegment.silent(duration=delay_ms) + layer_audio
-        
-        # Mix with result
-        result = result.overlay(layer_audio)
+    A layer is a dict with optional pitch_shift (semitones), volume (dB)
+    and delay (ms). Delayed layers end with the dry signal, like overlay.
+    """
+    stages = pitch_shift_stages(layer.get('pitch_shift', 0), channels)
+    if layer.get('volume'):
+        stages.append(GainStage(layer['volume']))
+    delay = int(round(layer.get('delay', 0) * sample_rate / 1000))
+    if delay > 0:
+        stages.append(DelayStage(delay, channels))
+    return stages
+
+def mix_layers(samples, branches):
+    """Sum a (channels, frames) buffer with each branch's rendering of it
     
-    return result
+    Layers render in parallel into one mix; the sum is scaled down only if
+    it would clip, instead of saturating like a 16-bit overlay.
+    """
+    mixed = process_buffer(samples, [ParallelMixStage(branches, samples.shape[0])])
+    peak = max(float(mixed.max(initial=0.0)), -float(mixed.min(initial=0.0)))
+    if peak > 1.0:
+        mixed *= 1.0 / peak
+    return mixed
 
-@app.route('/api/health', methods=['GET'])
-def health_check():
-    """Health check endpoint"""
-    return jsonify({'status': 'ok', 'message': 'AI Music Generator is running'})
+def resolve_tempo(mood, tempo, seed):
+    """The tempo compose_score will use for a request"""
+    if tempo is not None:
+        return tempo
+    return random.Random(seed).randint(*MOOD_PRESETS[mood]['tempo_range'])
 
-@app.route('/api/moods', methods=['GET'])
-def get_moods():
-    """Get available moods"""
-    moods = list(MOOD_PRESETS.keys())
-    return jsonify({'moods': moods})
+def compose_score(mood, genre, duration, tempo, seed, bass=True):
+    """Compose the melody and bass score for a request; returns (score, tempo)
+    
+    tempo=None picks one from the mood's range using the seeded generator.
+    bass=False leaves the bass out for callers that mix in a shared one.
+    """
+    # Get presets
+    mood_preset = MOOD_PRESETS[mood]
+    genre_preset = GENRE_PRESETS[genre]
+    
+    # Per-request generator, so concurrent requests never share RNG state
+    rng = random.Random(seed)
+    
+    # Adjust tempo based on mood if not specified
+    if tempo is None:
+        tempo_min, tempo_max = mood_preset['tempo_range']
+        tempo = rng.randint(tempo_min, tempo_max)
+    
+    # Compose melody
+    score = generate_melody(mood_preset, genre_preset, duration, tempo, rng)
+    
+    # Add bass line
+    if bass:
+        add_bass_line(score, mood_preset, genre_preset, tempo)
+    
+    return score, tempo
 
-@app.route('/api/genres', methods=['GET'])
-def get_genres():
-    """Get available genres"""
-    genres = list(GENRE_PRESETS.keys())
-    return jsonify({'genres': genres})
+def export_generated(music, mood, genre, filename):
+    """Apply genre effects to a rendered mono buffer, normalize and save it"""
+    meter = LoudnessMeter(SAMPLE_RATE, 1)
+    stages = build_effect_stages(GENRE_PRESETS[genre]['effects'], MOOD_PRESETS[mood], SAMPLE_RATE, 1)
+    with timed('effects'):
+        music = process_buffer(music[np.newaxis, :], stages + [meter])
+    
+    # Loudness normalization with a true-peak limiter
+    with timed('normalize'):
+        music, _ = normalize_loudness(music, SAMPLE_RATE, meter.integrated())
+    
+    # Export audio
+    output_path = os.path.join(GENERATED_FOLDER, filename)
+    with timed('export'):
+        sf.write(output_path, music.T, SAMPLE_RATE, subtype='PCM_16')
+    count_bytes('export', os.path.getsize(output_path))
 
-@app.route('/api/generate', methods=['POST'])
-def generate_music():
+def process_generate(mood, genre, duration, tempo, seed, filename, progress=None):
+    """Render a generation request into GENERATED_FOLDER and return the response payload
+    
+    tempo=None picks one from the mood's range. progress, if given, is
+    called with the completed fraction after each stage.
+    """
+    progress = progress or (lambda fraction: None)
+    with timed('compose'):
+        score, tempo = compose_score(mood, genre, duration, tempo, seed)
+    
+    # Render melody and bass in a single pass
+    with timed('render'):
+        music = render_score(score)
+    count_bytes('render', music.nbytes)
+    progress(0.4)
+    
+    # Effects, normalization and export
+    export_generated(music, mood, genre, filename)
+    output_store.register(filename, 'generate', {
+        'mood': mood, 'genre': genre, 'duration': duration, 'tempo': tempo, 'seed': seed})
+    progress(1.0)
+    
+    return {
+        'success': True,
+        'filename': filename,
+        'mood': mood,
+        'genre': genre,
+        'tempo': tempo,
+        'duration': duration,
+        'seed': seed
+    }
+
+def process_generate_batch(items, progress=None):
+    """Render several generation requests in one worker, sharing bass renders
+    
+    The bass line only depends on the mood and tempo, so it is rendered
+    once per pair at the longest duration requested and sliced for each
+    track. Returns one response payload per item, in order.
+    """
+    progress = progress or (lambda fraction: None)
+    keys = [(item['mood'], resolve_tempo(item['mood'], item['tempo'], item['seed'])) for item in items]
+    longest = {}
+    for key, item in zip(keys, items):
+        longest[key] = max(longest.get(key, 0), item['duration'])
+    
+    basses = {}
+    results = []
+    for i, (key, item) in enumerate(zip(keys, items)):
+        mood, genre = item['mood'], item['genre']
+        with timed('compose'):
+            score, tempo = compose_score(mood, genre, item['duration'], item['tempo'], item['seed'], bass=False)
+        with timed('render'):
+            music = render_score(score)
+            
+            if key not in basses:
+                bass_score = Score(longest[key])
+                add_bass_line(bass_score, MOOD_PRESETS[mood], GENRE_PRESETS[genre], tempo)
+                basses[key] = render_score(bass_score)
+            music += basses[key][:len(music)]
+        
+        export_generated(music, mood, genre, item['filename'])
+        output_store.register(item['filename'], 'generate', {
+            'mood': mood, 'genre': genre, 'duration': item['duration'], 'tempo': tempo, 'seed': item['seed']})
+        results.append({
+            'success': True,
+            'filename': item['filename'],
+            'mood': mood,
+            'genre': genre,
+            'tempo': tempo,
+            'duration': item['duration'],
+            'seed': item['seed']
+        })
+        progress((i + 1) / len(items))
+    
+    return results
+
+# Progressive generation: blocks are rendered, effected and sent as they are
+# ready, so a fixed per-preset gain stands in for full-track normalization
+
+stream_gains = {}
+
+def preset_stream_gain(mood, genre, seeds=4, duration=10):
+    """Fixed output gain in dB for streamed tracks of a mood/genre pair
+    
+    A streamed track's loudness isn't known before its first block is
+    sent, so the gain takes the mean loudness of a few reference renders
+    to TARGET_LOUDNESS; the true-peak limiter catches louder passages.
+    """
+    key = (mood, genre)
+    if key not in stream_gains:
+        effects = GENRE_PRESETS[genre]['effects']
+        energy = []
+        for seed in range(seeds):
+            score, _ = compose_score(mood, genre, duration, None, seed)
+            meter = LoudnessMeter(SAMPLE_RATE, 1)
+            meter.process(apply_effects(render_score(score)[np.newaxis, :], effects, MOOD_PRESETS[mood]))
+            energy.append(10 ** (meter.integrated() / 10))
+        stream_gains[key] = loudness_gain_db(10 * np.log10(np.mean(energy)))
+    return stream_gains[key]
+
+def wav_header(frames, sample_rate, channels, sample_width=2):
+    """44-byte PCM WAV header for a stream of known length"""
+    data_size = frames * channels * sample_width
+    return struct.pack('<4sI4s4sIHHIIHH4sI', b'RIFF', 36 + data_size, b'WAVE', b'fmt ', 16, 1,
+                       channels, sample_rate, sample_rate * channels * sample_width,
+                       channels * sample_width, sample_width * 8, b'data', data_size)
+
+def stream_generate(mood, genre, duration, tempo, seed):
+    """Compose a track and return (tempo, frames, chunks) for a progressive WAV
+    
+    chunks yields the WAV header and then 16-bit PCM one STREAM_BLOCK_SIZE
+    block at a time, so the first audio is sent after one block is rendered.
+    """
+    score, tempo = compose_score(mood, genre, duration, tempo, seed)
+    stages = build_effect_stages(GENRE_PRESETS[genre]['effects'], MOOD_PRESETS[mood], SAMPLE_RATE, 1)
+    frames = output_length(stages, int(round(score.length * SAMPLE_RATE)))
+    stages.append(TruePeakLimiterStage(preset_stream_gain(mood, genre), TRUE_PEAK_CEILING, SAMPLE_RATE, 1))
+    
+    def chunks():
+        yield wav_header(frames, SAMPLE_RATE, 1)
+        remaining = frames
+        blocks = (block[np.newaxis, :] for block in render_score_blocks(score))
+        for block in run_stages(blocks, stages):
+            block = block[:, :remaining]
+            remaining -= block.shape[1]
+            pcm = np.clip(block, -1.0, 1.0).T * 32767
+            yield pcm.astype('<i2').tobytes()
+        # The header promised this many frames; never send a short file
+        if remaining > 0:
+            yield bytes(remaining * 2)
+    
+    return tempo, frames, chunks()
+
+def parse_tempo_change(value):
+    """Validate a remix tempo_change and limit it to 0.5x-2.0x"""
+    rate = float(value)
+    if not np.isfinite(rate) or rate <= 0:
+        raise ValueError('tempo_change must be a finite positive number')
+    return min(max(rate, 0.5), 2.0)
+
+def parse_layers(text):
+    """Validate the JSON list of layers sent with a remix request"""
+    layers = json.loads(text)
+    if not isinstance(layers, list) or len(layers) > REMIX_MAX_LAYERS:
+        raise ValueError(f'expected a list of at most {REMIX_MAX_LAYERS} layers')
+    
+    parsed = []
+    for layer in layers:
+        if not isinstance(layer, dict) or set(layer) - {'pitch_shift', 'volume', 'delay'}:
+            raise ValueError('each layer is an object with pitch_shift, volume and/or delay')
+        layer = {key: float(value) for key, value in layer.items()}
+        if not (-24 <= layer.get('pitch_shift', 0) <= 24 and -60 <= layer.get('volume', 0) <= 12
+                and 0 <= layer.get('delay', 0) <= 10000):
+            raise ValueError('pitch_shift must be within 24 semitones, volume between -60 and 12 dB '
+                             'and delay between 0 and 10000 ms')
+        parsed.append(layer)
+    return parsed
+
+def build_remix_stages(options, sample_rate, channels):
+    """Build the full remix stage chain for a request's options"""
+    mood_preset = MOOD_PRESETS.get(options['mood'], MOOD_PRESETS['happy'])
+    genre_preset = GENRE_PRESETS.get(options['genre'], GENRE_PRESETS['electronic'])
+    stages = []
+    
+    # Intelligent mood transformation: gain, filter, tempo
+    if options['intelligent_transform']:
+        plan = mood_transform_plan(options['source_mood'], options['mood'], sample_rate)
+        stages += label_stages(plan_stages(plan, channels), 'mood_transform')
+    
+    # Pitch shift and tempo change
+    stages += label_stages(pitch_shift_stages(options['pitch_shift'], channels), 'pitch_shift')
+    stages += label_stages(time_stretch_stages(parse_tempo_change(options['tempo_change']), channels),
+                           'time_stretch')
+    
+    # Genre effects
+    stages += label_stages(build_effect_stages(genre_preset['effects'], mood_preset, sample_rate, channels),
+                           'effects')
+    
+    # Harmony and extra layers run as parallel branches mixed back in as
+    # blocks arrive
+    branches = []
+    if options['add_harmony'] and options['harmony_type'] in HARMONY_INTERVALS:
+        branches.append(harmony_stages(options['harmony_type'], channels))
+    layers = options.get('layers') or []
+    branches += [layer_stages(layer, sample_rate, channels) for layer in layers]
+    if branches:
+        stages += label_stages([ParallelMixStage(branches, channels)], 'layers' if layers else 'harmony')
+    
+    # Adjust brightness based on mood. The mix above is unclipped, so
+    # nothing clips from here until export, after the limiter
+    brightness = mood_preset['brightness']
+    if brightness < 0.5:
+        stages += label_stages([FilterStage('low', 4000, sample_rate, channels, clip=False)], 'brightness')
+    elif brightness > 0.7:
+        stages += label_stages([FilterStage('high', 150, sample_rate, channels, clip=False)], 'brightness')
+    
+    return stages
+
+def process_remix(upload, filename, options, progress=None, features=None):
+    """Remix an upload (path or file object) into GENERATED_FOLDER and return the response payload
+    
+    features, when already known for this upload, skips re-analysis.
+    """
+    if options.get('streaming'):
+        return process_remix_streaming(upload, filename, options, progress, features)
+    
+    progress = progress or (lambda fraction: None)
+    mood = options['mood']
+    genre = options['genre']
+    pitch_shift = options['pitch_shift']
+    tempo_change = options['tempo_change']
+    
+    # Decode once into float32; everything after works on this buffer
+    with timed('decode'):
+        samples, sample_rate = load_audio(upload)
+    count_bytes('decode', samples.nbytes)
+    progress(0.2)
+    
+    # Analyze original audio features, the same analysis /api/analyze stores
+    with timed('analyze'):
+        audio_features = features or analyze_track(samples, sample_rate)
+    
+    # Transform, pitch, tempo, effects, harmony and brightness in one chain,
+    # metering loudness on the way out
+    meter = LoudnessMeter(sample_rate, samples.shape[0])
+    stages = build_remix_stages(options, sample_rate, samples.shape[0])
+    samples = process_buffer(samples, stages + [meter])
+    progress(0.8)
+    
+    # Loudness normalization with a true-peak limiter
+    with timed('normalize'):
+        samples, _ = normalize_loudness(samples, sample_rate, meter.integrated())
+    
+    # Save remixed audio
+    output_path = os.path.join(GENERATED_FOLDER, filename)
+    with timed('export'):
+        sf.write(output_path, np.clip(samples, -1.0, 1.0).T, sample_rate, subtype='PCM_16')
+    count_bytes('export', os.path.getsize(output_path))
+    output_store.register(filename, 'remix', options)
+    progress(1.0)
+    
+    return {
+        'success': True,
+        'filename': filename,
+        'mood': mood,
+        'genre': genre,
+        'audio_features': audio_features,
+        'applied_effects': {
+            'pitch_shift': pitch_shift,
+            'tempo_change': tempo_change,
+            'harmony': options['harmony_type'] if options['add_harmony'] else None,
+            'layers': options.get('layers', []),
+            'intelligent_transform': options['intelligent_transform']
+        }
+    }
+
+# Streaming remix: the same pipeline as process_remix, run over fixed-size
+# blocks so memory stays flat no matter how long the upload is
+
+def is_path(source):
+    """True if an audio source is a filesystem path rather than a file object"""
+    return isinstance(source, (str, os.PathLike))
+
+def _feed_stdin(process, source):
+    """Copy a file object into a subprocess's stdin"""
+    try:
+        source.seek(0)
+        shutil.copyfileobj(source, process.stdin, 1024 * 1024)
+    except OSError:
+        pass  # The reader exited early; ffprobe stops once it has the header
+    finally:
+        try:
+            process.stdin.close()
+        except OSError:
+            pass
+
+def start_media_process(command, source):
+    """Start an ffmpeg/ffprobe command reading source, a path or a file object
+    
+    File objects are fed through stdin from a background thread; returns
+    (process, feeder) where feeder is that thread or None.
+    """
+    if is_path(source):
+        return subprocess.Popen(command, stdout=subprocess.PIPE), None
+    
+    process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    feeder = threading.Thread(target=_feed_stdin, args=(process, source), daemon=True)
+    feeder.start()
+    return process, feeder
+
+def media_input(source):
+    """ffmpeg input argument for a path, or for a file object piped to stdin"""
+    # cache: lets ffmpeg seek back in piped input (MP4 with a trailing index)
+    return os.fspath(source) if is_path(source) else 'cache:pipe:0'
+
+def finish_media_process(process, feeder):
+    """Wait for a media process and its feeder, raising if the process failed"""
+    process.stdout.close()
+    returncode = process.wait()
+    if feeder is not None:
+        feeder.join()
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, process.args)
+
+def probe_audio(source):
+    """Return (sample_rate, channels) of the first audio stream via ffprobe"""
+    # AudioSegment.ffprobe is only set when the bundled FFMPEG_PATH exists
+    prober = getattr(AudioSegment, 'ffprobe', None) or get_prober_name()
+    command = [prober, '-v', 'quiet', '-of', 'json', '-show_streams',
+               '-select_streams', 'a:0', '-i', media_input(source)]
+    process, feeder = start_media_process(command, source)
+    output = process.stdout.read()
+    finish_media_process(process, feeder)
+    
+    streams = json.loads(output or b'{}').get('streams')
+    if not streams:
+        raise ValueError('No audio stream found')
+    return int(streams[0]['sample_rate']), int(streams[0]['channels'])
+
+def ffmpeg_decode_command(source):
+    """ffmpeg command decoding source to interleaved float32 on stdout"""
+    return [AudioSegment.converter, '-v', 'quiet', '-i', media_input(source),
+            '-f', 'f32le', '-acodec', 'pcm_f32le', '-']
+
+def read_blocks(source, block_size):
+    """Yield float32 (channels, frames) blocks from a soundfile-readable source"""
+    if not is_path(source):
+        source.seek(0)
+    with sf.SoundFile(source) as f:
+        while True:
+            data = f.read(block_size, dtype='float32', always_2d=True)
+            if not len(data):
+                break
+            yield data.T
+
+def open_audio_blocks(source, block_size):
+    """Open an audio path or file object for block-wise decoding
+    
+    Returns (sample_rate, channels, blocks) where blocks yields float32
+    (channels, frames) arrays. Formats libsndfile can't read are decoded
+    through an ffmpeg pipe.
+    """
+    try:
+        if not is_path(source):
+            source.seek(0)
+        info = sf.info(source)
+    except (RuntimeError, sf.LibsndfileError):
+        info = None
+    
+    if info is not None:
+        return info.samplerate, info.channels, read_blocks(source, block_size)
+    
+    sample_rate, channels = probe_audio(source)
+    
+    def blocks():
+        process, feeder = start_media_process(ffmpeg_decode_command(source), source)
+        try:
+            while True:
+                raw = process.stdout.read(block_size * channels * 4)
+                if not raw:
+                    break
+                pcm = np.frombuffer(raw[:len(raw) - len(raw) % (channels * 4)], dtype=np.float32)
+                yield pcm.reshape(-1, channels).T
+        finally:
+            finish_media_process(process, feeder)
+    
+    return sample_rate, channels, blocks()
+
+def load_audio(source):
+    """Decode a whole path or file object once into a float32 (channels, frames) buffer
+    
+    Returns (samples, sample_rate). WAV, FLAC and other libsndfile formats
+    are read directly; anything else goes through an ffmpeg pipe.
+    """
+    try:
+        if not is_path(source):
+            source.seek(0)
+        data, sample_rate = sf.read(source, dtype='float32', always_2d=True)
+    except (RuntimeError, sf.LibsndfileError):
+        sample_rate, channels = probe_audio(source)
+        process, feeder = start_media_process(ffmpeg_decode_command(source), source)
+        raw = process.stdout.read()
+        finish_media_process(process, feeder)
+        # One copy from the pipe's bytes into a writable planar buffer
+        return np.frombuffer(raw, dtype=np.float32).reshape(-1, channels).T.copy(), sample_rate
+    
+    # One interleaved-to-planar copy; a mono file is already contiguous
+    return np.ascontiguousarray(data.T), sample_rate
+
+def _remove_files(paths):
+    """Delete files, ignoring ones that are already gone"""
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def process_remix_streaming(upload, filename, options, progress=None, features=None):
+    """Block-wise process_remix with bounded memory for long uploads
+    
+    Processed audio is spooled to a float temp file because normalization
+    needs the integrated loudness before the final 16-bit file is written.
+    """
+    progress = progress or (lambda fraction: None)
+    block_size = STREAM_BLOCK_SIZE
+    mood = options['mood']
+    genre = options['genre']
+    pitch_shift = options['pitch_shift']
+    tempo_change = options['tempo_change']
+    
+    sample_rate, channels, source = open_audio_blocks(upload, block_size)
+    accumulator = FeatureAccumulator()
+    
+    def analyzed(blocks):
+        for block in blocks:
+            if features is None:
+                with timed('analyze'):
+                    accumulator.add(block)
+            yield block
+    
+    meter = LoudnessMeter(sample_rate, channels)
+    stages = build_remix_stages(options, sample_rate, channels) + [meter]
+    
+    spools = []
+    
+    def spool(blocks):
+        """Write blocks to a float temp file, returning its path"""
+        fd, path = tempfile.mkstemp(suffix='.w64')
+        os.close(fd)
+        spools.append(path)
+        with sf.SoundFile(path, 'w', samplerate=sample_rate, channels=channels,
+                          format='W64', subtype='FLOAT') as f:
+            for block in blocks:
+                if block.shape[1]:
+                    f.write(block.T)
+        return path
+    
+    try:
+        mixed_path = spool(run_stages(analyzed(timed_blocks(source, 'decode')), stages))
+        progress(0.8)
+        
+        # Loudness gain and true-peak limiting, applied while writing the output
+        limiter = TruePeakLimiterStage(loudness_gain_db(meter.integrated()), TRUE_PEAK_CEILING,
+                                       sample_rate, channels)
+        output_path = os.path.join(GENERATED_FOLDER, filename)
+        with timed('export'):
+            with sf.SoundFile(output_path, 'w', samplerate=sample_rate,
+                              channels=channels, format='WAV', subtype='PCM_16') as out:
+                for block in run_stages(read_blocks(mixed_path, block_size), [limiter]):
+                    out.write(np.clip(block, -1.0, 1.0).T)
+        count_bytes('export', os.path.getsize(output_path))
+        output_store.register(filename, 'remix', options)
+        progress(1.0)
+    finally:
+        _remove_files(spools)
+    
+    return {
+        'success': True,
+        'filename': filename,
+        'mood': mood,
+        'genre': genre,
+        'audio_features': features or accumulator.features(),
+        'applied_effects': {
+            'pitch_shift': pitch_shift,
+            'tempo_change': tempo_change,
+            'harmony': options['harmony_type'] if options['add_harmony'] else None,
+            'layers': options.get('layers', []),
+            'intelligent_transform': options['intelligent_transform']
+        },
+        'streaming': True
+    }
+
+# Bump when rendering changes so stale cached outputs aren't served
+CACHE_VERSION = 4
+
+def make_cache_key(kind, params):
+    """Hash a normalized request into a content-addressed cache key"""
+    payload = json.dumps({'kind': kind, 'params': params, 'version': CACHE_VERSION}, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class ResultCache:
+    """LRU cache mapping keys to files in a folder plus a JSON payload each
+    
+    Entries expire after max_age seconds and the least recently used ones
+    are evicted (file included) once the entry or byte limits are exceeded.
+    The index is persisted next to the files so hits survive restarts.
+    on_remove, if given, is called with the filename of every deleted file.
+    """
+    
+    def __init__(self, folder, max_entries, max_bytes, max_age, index_name='.result_cache.json',
+                 on_remove=None):
+        self.folder = folder
+        self.on_remove = on_remove
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.index_path = os.path.join(folder, index_name)
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self._load()
+    
+    def _load(self):
+        """Restore the index from disk, dropping entries whose file is gone"""
+        try:
+            with open(self.index_path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        
+        for key, entry in saved:
+            path = os.path.join(self.folder, entry['filename'])
+            if os.path.exists(path):
+                self.entries[key] = entry
+                self.total_bytes += entry['size']
+    
+    def _save(self):
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(list(self.entries.items()), f)
+        os.replace(tmp_path, self.index_path)
+    
+    def _remove(self, key, delete_file=True):
+        entry = self.entries.pop(key)
+        self.total_bytes -= entry['size']
+        if not delete_file:
+            return
+        try:
+            os.remove(os.path.join(self.folder, entry['filename']))
+        except OSError:
+            pass
+        if self.on_remove is not None:
+            self.on_remove(entry['filename'])
+    
+    def _evict(self):
+        now = time.time()
+        expired = [key for key, entry in self.entries.items()
+                   if now - entry['created'] > self.max_age]
+        for key in expired:
+            self._remove(key)
+        
+        while self.entries and (len(self.entries) > self.max_entries
+                                or self.total_bytes > self.max_bytes):
+            self._remove(next(iter(self.entries)))
+    
+    def get(self, key):
+        """Return the cached response for key, or None on a miss"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                path = os.path.join(self.folder, entry['filename'])
+                if time.time() - entry['created'] > self.max_age or not os.path.exists(path):
+                    self._remove(key)
+                    self._save()
+                    entry = None
+            
+            if entry is None:
+                self.misses += 1
+                return None
+            
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry['response']
+    
+    def put(self, key, filename, response):
+        """Record a freshly rendered file and its response payload"""
+        size = os.path.getsize(os.path.join(self.folder, filename))
+        with self.lock:
+            if key in self.entries:
+                # A re-render under the same name has replaced the old file
+                self._remove(key, delete_file=self.entries[key]['filename'] != filename)
+            self.entries[key] = {
+                'filename': filename,
+                'response': response,
+                'size': size,
+                'created': time.time()
+            }
+            self.total_bytes += size
+            self._evict()
+            self._save()
+    
+    def update(self, key, response):
+        """Replace the payload of an existing entry, keeping its file"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return False
+            entry['response'] = response
+            self._save()
+            return True
+    
+    def clear(self):
+        """Drop every entry along with its file"""
+        with self.lock:
+            for key in list(self.entries):
+                self._remove(key)
+            self._save()
+    
+    def stats(self):
+        """Hit/miss counters and current usage"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'bytes': self.total_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+# Files it evicts are also dropped from the output store's manifest below
+result_cache = ResultCache(GENERATED_FOLDER, RESULT_CACHE_MAX_ENTRIES, RESULT_CACHE_MAX_BYTES,
+                           RESULT_CACHE_MAX_AGE, on_remove=lambda filename: output_store.remove(filename))
+
+# Encoded variants of generated files served by /api/stream
+transcode_cache = ResultCache(TRANSCODE_FOLDER, TRANSCODE_CACHE_MAX_ENTRIES, TRANSCODE_CACHE_MAX_BYTES,
+                              RESULT_CACHE_MAX_AGE, index_name='.transcode_cache.json')
+
+# Uploads by content hash, with their decoded metadata and analysis results
+upload_store = ResultCache(UPLOAD_FOLDER, UPLOAD_STORE_MAX_ENTRIES, UPLOAD_STORE_MAX_BYTES,
+                           UPLOAD_STORE_MAX_AGE, index_name='.upload_store.json')
+
+# Output store: a SQLite manifest of every file rendered into GENERATED_FOLDER,
+# read back through mmap and trimmed to OUTPUT_STORE_MAX_BYTES by a janitor
+
+OUTPUT_STORE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS outputs (
+    filename TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    params TEXT NOT NULL,
+    duration REAL,
+    format TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS outputs_accessed ON outputs (accessed);
+DROP INDEX IF EXISTS outputs_created;
+DROP INDEX IF EXISTS outputs_kind_created;
+CREATE INDEX IF NOT EXISTS outputs_created_filename ON outputs (created, filename);
+CREATE INDEX IF NOT EXISTS outputs_kind_created_filename ON outputs (kind, created, filename);
+CREATE TABLE IF NOT EXISTS totals (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    entries INTEGER NOT NULL,
+    bytes INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO totals VALUES (0, 0, 0);
+CREATE TRIGGER IF NOT EXISTS outputs_insert AFTER INSERT ON outputs BEGIN
+    UPDATE totals SET entries = entries + 1, bytes = bytes + NEW.size;
+END;
+CREATE TRIGGER IF NOT EXISTS outputs_delete AFTER DELETE ON outputs BEGIN
+    UPDATE totals SET entries = entries - 1, bytes = bytes - OLD.size;
+END;
+CREATE TRIGGER IF NOT EXISTS outputs_resize AFTER UPDATE OF size ON outputs BEGIN
+    UPDATE totals SET bytes = bytes - OLD.size + NEW.size;
+END;
+'''
+
+# Kind recorded for files found on disk without a manifest row, by name prefix
+OUTPUT_KINDS = {'generated_': 'generate', 'remix_': 'remix', 'batch_': 'archive'}
+
+class OutputStore:
+    """Manifest of the files in a folder: parameters, duration, format and size
+    
+    Lookups and listings go through SQLite indexes and the entry and byte
+    totals are kept up to date by triggers, so none of them slow down as
+    the store grows. Job worker processes record their outputs through
+    their own connections; WAL mode lets them write while requests read.
+    """
+    
+    # Access times are only written back when older than this many seconds
+    touch_interval = 60
+    
+    def __init__(self, folder, max_bytes, index_name='.manifest.sqlite3'):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.path = os.path.join(folder, index_name)
+        self.local = threading.local()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.janitor = None
+        self.janitor_lock = threading.Lock()
+        self._connect().executescript(OUTPUT_STORE_SCHEMA)
+    
+    def _connect(self):
+        """This thread's connection, reopened in forked job workers"""
+        db = getattr(self.local, 'db', None)
+        if db is None or self.local.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self.local.db, self.local.pid = db, os.getpid()
+        return db
+    
+    @staticmethod
+    def _entry(row):
+        entry = dict(row)
+        entry['params'] = json.loads(entry['params'])
+        return entry
+    
+    def register(self, filename, kind, params):
+        """Record a file just written to the folder, replacing any earlier row"""
+        path = os.path.join(self.folder, filename)
+        size = os.path.getsize(path)
+        try:
+            duration = sf.info(path).duration
+        except RuntimeError:
+            duration = None  # not audio, e.g. a batch archive
+        now = time.time()
+        self._connect().execute(
+            'INSERT INTO outputs VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (filename) DO UPDATE SET '
+            'kind = excluded.kind, params = excluded.params, duration = excluded.duration, '
+            'format = excluded.format, size = excluded.size, created = excluded.created, '
+            'accessed = excluded.accessed',
+            (filename, kind, json.dumps(params, sort_keys=True), duration,
+             os.path.splitext(filename)[1].lstrip('.').lower(), size, now, now))
+    
+    def lookup(self, filename):
+        """Manifest entry for filename, marking it recently used, or None"""
+        db = self._connect()
+        row = db.execute('SELECT * FROM outputs WHERE filename = ?', (filename,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        
+        self.hits += 1
+        now = time.time()
+        if now - row['accessed'] > self.touch_interval:
+            db.execute('UPDATE outputs SET accessed = ? WHERE filename = ?', (now, filename))
+        return self._entry(row)
+    
+    def remove(self, filename):
+        """Forget a file deleted by someone else (the result cache, or by hand)"""
+        self._connect().execute('DELETE FROM outputs WHERE filename = ?', (filename,))
+    
+    def list(self, kind=None, before=None, limit=50):
+        """Newest entries first, ties broken by filename
+        
+        Pass the last entry's (created, filename) as before for the next
+        page, so rows written in the same instant are never skipped.
+        """
+        created, filename = before if before is not None else (float('inf'), '')
+        query, args = 'SELECT * FROM outputs WHERE (created, filename) < (?, ?)', [created, filename]
+        if kind is not None:
+            query += ' AND kind = ?'
+            args.append(kind)
+        query += ' ORDER BY created DESC, filename DESC LIMIT ?'
+        args.append(limit)
+        return [self._entry(row) for row in self._connect().execute(query, args)]
+    
+    def enforce_quota(self):
+        """Delete least recently used files until the total fits max_bytes"""
+        db = self._connect()
+        excess = self.stats()['bytes'] - self.max_bytes
+        removed = 0
+        while excess > 0:
+            rows = db.execute('SELECT filename, size FROM outputs ORDER BY accessed LIMIT 256').fetchall()
+            if not rows:
+                break
+            victims = []
+            for row in rows:
+                if excess <= 0:
+                    break
+                victims.append(row['filename'])
+                excess -= row['size']
+            
+            # Rows go first; open memory maps keep serving a deleted file
+            db.execute('BEGIN IMMEDIATE')
+            db.executemany('DELETE FROM outputs WHERE filename = ?', [(name,) for name in victims])
+            db.execute('COMMIT')
+            _remove_files(os.path.join(self.folder, name) for name in victims)
+            removed += len(victims)
+        
+        self.evictions += removed
+        return removed
+    
+    def adopt(self):
+        """Index audio and archives already in the folder but missing from the manifest"""
+        db = self._connect()
+        adopted = 0
+        for item in os.scandir(self.folder):
+            if not item.is_file() or item.name.startswith('.'):
+                continue
+            if db.execute('SELECT 1 FROM outputs WHERE filename = ?', (item.name,)).fetchone():
+                continue
+            kind = next((kind for prefix, kind in OUTPUT_KINDS.items() if item.name.startswith(prefix)), 'other')
+            self.register(item.name, kind, {})
+            adopted += 1
+        return adopted
+    
+    def _run_janitor(self, interval):
+        self.adopt()
+        while True:
+            try:
+                self.enforce_quota()
+            except Exception as e:
+                print(f"⚠ Output store janitor failed: {e}")
+            time.sleep(interval)
+    
+    def start_janitor(self, interval):
+        """Start the quota-enforcing thread once per process"""
+        with self.janitor_lock:
+            if self.janitor is None:
+                self.janitor = threading.Thread(target=self._run_janitor, args=(interval,), daemon=True)
+                self.janitor.start()
+    
+    def stats(self):
+        """Entry and byte totals plus lookup counters"""
+        row = self._connect().execute('SELECT entries, bytes FROM totals').fetchone()
+        lookups = self.hits + self.misses
+        return {
+            'entries': row['entries'],
+            'bytes': row['bytes'],
+            'max_bytes': self.max_bytes,
+            'evictions': self.evictions,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+
+output_store = OutputStore(GENERATED_FOLDER, OUTPUT_STORE_MAX_BYTES)
+
+def send_mapped(path, mimetype=None, as_attachment=False):
+    """Serve a file from a read-only memory map, with Range and conditional GET support
+    
+    Pages come straight from the OS page cache, shared by every request
+    reading the same file, and the map stays valid if the janitor deletes
+    the file mid-download.
+    """
+    with open(path, 'rb') as f:
+        stat = os.fstat(f.fileno())
+        # mmap can't map an empty file
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if stat.st_size else io.BytesIO()
+    
+    name = os.path.basename(path)
+    response = app.response_class(wrap_file(request.environ, mapped, buffer_size=256 * 1024),
+                                  mimetype=mimetype or mimetypes.guess_type(name)[0] or 'application/octet-stream',
+                                  direct_passthrough=True)
+    response.content_length = stat.st_size
+    response.last_modified = stat.st_mtime
+    response.set_etag(f'{stat.st_mtime_ns:x}-{stat.st_size:x}')
+    response.cache_control.no_cache = True
+    if as_attachment:
+        response.headers.set('Content-Disposition', 'attachment', filename=name)
+    return response.make_conditional(request.environ, accept_ranges=True, complete_length=stat.st_size)
+
+# Instrumentation: per-request stage timers, Prometheus metrics and an
+# opt-in sampling profiler for slow requests
+
+class StageTimer:
+    """Seconds and bytes spent in each pipeline stage during one request"""
+    
+    def __init__(self):
+        self.stages = OrderedDict()
+    
+    def add(self, stage, seconds, nbytes=0):
+        totals = self.stages.setdefault(stage, [0.0, 0])
+        totals[0] += seconds
+        totals[1] += nbytes
+    
+    def server_timing(self, total):
+        """Server-Timing header value, durations in milliseconds"""
+        entries = [f'{stage};dur={seconds * 1000:.1f}' for stage, (seconds, _) in self.stages.items()]
+        entries.append(f'total;dur={total * 1000:.1f}')
+        return ', '.join(entries)
+
+_request_state = threading.local()
+
+def current_timer():
+    """The StageTimer of the request being handled on this thread, if any"""
+    return getattr(_request_state, 'timer', None)
+
+@contextmanager
+def timed(stage):
+    """Add the time spent in the with-block to the current request's stage"""
+    timer = current_timer()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timer is not None:
+            timer.add(stage, time.perf_counter() - start)
+
+def count_bytes(stage, nbytes):
+    """Add a byte count to the current request's stage"""
+    timer = current_timer()
+    if timer is not None:
+        timer.add(stage, 0.0, nbytes)
+
+def timed_blocks(blocks, stage):
+    """Pass blocks through, attributing the time spent producing them to stage"""
+    blocks = iter(blocks)
+    while True:
+        timer = current_timer()
+        start = time.perf_counter()
+        try:
+            block = next(blocks)
+        except StopIteration:
+            return
+        if timer is not None:
+            timer.add(stage, time.perf_counter() - start, block.nbytes)
+        yield block
+
+def label_stages(stages, label):
+    """Tag stages so run_stages reports their time under label"""
+    for stage in stages:
+        stage.label = label
+    return stages
+
+class MetricsRegistry:
+    """Counters and latency histograms rendered in the Prometheus text format"""
+    
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counters = {}
+        self.histograms = {}
+        self.descriptions = {}
+        self.lock = threading.Lock()
+    
+    def describe(self, name, kind, text):
+        self.descriptions[name] = (kind, text)
+    
+    def inc(self, name, labels, amount=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+    
+    def observe(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                histogram['buckets'][index] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+    
+    @staticmethod
+    def _labels(labels, **extra):
+        items = list(labels) + list(extra.items())
+        if not items:
+            return ''
+        escape = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        return '{' + ','.join(f'{key}="{escape(value)}"' for key, value in items) + '}'
+    
+    def _header(self, lines, name, kind, text=None):
+        kind, text = self.descriptions.get(name, (kind, text))
+        if text:
+            lines.append(f'# HELP {name} {text}')
+        lines.append(f'# TYPE {name} {kind}')
+    
+    def render(self, extra=()):
+        """Exposition text; extra is (name, kind, help, [(labels, value)]) read at scrape time"""
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, dict(value, buckets=list(value['buckets'])))
+                                for key, value in self.histograms.items())
+        
+        current = None
+        for (name, labels), value in counters:
+            if name != current:
+                self._header(lines, name, 'counter')
+                current = name
+            lines.append(f'{name}{self._labels(labels)} {value}')
+        
+        for (name, labels), histogram in histograms:
+            if name != current:
+                self._header(lines, name, 'histogram')
+                current = name
+            cumulative = 0
+            for bound, count in zip(self.buckets, histogram['buckets']):
+                cumulative += count
+                lines.append(f'{name}_bucket{self._labels(labels, le=bound)} {cumulative}')
+            lines.append(f'{name}_bucket{self._labels(labels, le="+Inf")} {histogram["count"]}')
+            lines.append(f'{name}_sum{self._labels(labels)} {histogram["sum"]}')
+            lines.append(f'{name}_count{self._labels(labels)} {histogram["count"]}')
+        
+        for name, kind, text, samples in extra:
+            self._header(lines, name, kind, text)
+            for labels, value in samples:
+                lines.append(f'{name}{self._labels(sorted(labels.items()))} {value}')
+        
+        return '\n'.join(lines) + '\n'
+
+metrics = MetricsRegistry((0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0))
+metrics.describe('http_requests_total', 'counter', 'Requests handled, by endpoint, method and status')
+metrics.describe('http_request_duration_seconds', 'histogram', 'Request latency by endpoint')
+metrics.describe('pipeline_stage_duration_seconds', 'histogram', 'Time per request spent in each pipeline stage')
+metrics.describe('pipeline_stage_bytes_total', 'counter', 'Audio bytes produced by each pipeline stage')
+
+class StackSampler:
+    """Sampling profiler for one thread, producing folded stacks
+    
+    A daemon thread records the target thread's Python stack every
+    interval seconds. Output is the folded format read by flamegraph.pl
+    and speedscope: one 'outer;...;inner count' line per distinct stack.
+    """
+    
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = {}
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+    
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{frame.f_globals.get('__name__', '?')}.{code.co_name}:{code.co_firstlineno}")
+                frame = frame.f_back
+            if stack:
+                key = ';'.join(reversed(stack))
+                self.counts[key] = self.counts.get(key, 0) + 1
+    
+    def start(self):
+        self.thread.start()
+        return self
+    
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        return self.counts
+    
+    def dump(self, path):
+        with open(path, 'w') as f:
+            for stack, count in sorted(self.counts.items()):
+                f.write(f'{stack} {count}\n')
+
+# Background jobs: pipelines run in a process pool so DSP work leaves the
+# request thread and spreads across cores
+JOB_TASKS = {
+    'generate': process_generate,
+    'generate_batch': process_generate_batch,
+    'remix': process_remix
+}
+
+jobs = {}
+jobs_lock = threading.Lock()
+job_executor = None
+job_executor_lock = threading.Lock()
+progress_queue = None
+_worker_progress_queue = None
+
+def _init_job_worker(queue):
+    """Process pool initializer: keep the progress queue for _run_job"""
+    global _worker_progress_queue
+    _worker_progress_queue = queue
+
+def _run_job(job_id, task, kwargs):
+    """Worker-side entry point: run a pipeline and report progress back"""
+    def progress(fraction):
+        _worker_progress_queue.put((job_id, fraction))
+    
+    progress(0.0)
+    return JOB_TASKS[task](progress=progress, **kwargs)
+
+def _drain_progress(queue):
+    """Apply progress messages from workers to the job table"""
+    while True:
+        job_id, fraction = queue.get()
+        with jobs_lock:
+            job = jobs.get(job_id)
+            if job is not None and job['status'] in ('queued', 'running'):
+                job['status'] = 'running'
+                job['progress'] = fraction
+
+def _get_job_executor(broken=None):
+    """Start the worker pool and progress listener on first use
+    
+    Pass a pool that raised BrokenProcessPool (a worker died) as broken to
+    replace it. The new pool gets its own progress queue, since a worker
+    killed mid-put can leave the old one's lock held.
+    """
+    global job_executor, progress_queue
+    with job_executor_lock:
+        if job_executor is not None and job_executor is broken:
+            job_executor.shutdown(wait=False, cancel_futures=True)
+            job_executor = None
+        if job_executor is None:
+            progress_queue = multiprocessing.Queue()
+            threading.Thread(target=_drain_progress, args=(progress_queue,), daemon=True).start()
+            job_executor = ProcessPoolExecutor(max_workers=JOB_WORKERS,
+                                               initializer=_init_job_worker,
+                                               initargs=(progress_queue,))
+        return job_executor
+
+def _submit_to_pool(*args):
+    """Submit to the job pool, replacing it once if it turns out to be broken"""
+    executor = _get_job_executor()
+    try:
+        return executor.submit(*args)
+    except BrokenProcessPool:
+        return _get_job_executor(broken=executor).submit(*args)
+
+def _prune_jobs():
+    """Forget finished jobs older than JOB_RETENTION seconds"""
+    cutoff = time.time() - JOB_RETENTION
+    for job_id in [job_id for job_id, job in jobs.items()
+                   if job['status'] in ('done', 'failed') and job['finished'] < cutoff]:
+        del jobs[job_id]
+
+def submit_jobs(task, kwargs_list, cache_key=None, on_result=None):
+    """Queue several pipeline runs at once, all or none
+    
+    Returns a (job_id, future) pair per run, or None if they don't all fit
+    within JOB_QUEUE_DEPTH. cache_key, if given, caches each run's result.
+    on_result, if given, is called in this process with each result before
+    it is cached and may add to it.
+    """
+    with jobs_lock:
+        _prune_jobs()
+        pending = sum(1 for job in jobs.values() if job['status'] in ('queued', 'running'))
+        if pending + len(kwargs_list) > JOB_QUEUE_DEPTH:
+            return None
+        
+        job_ids = [uuid.uuid4().hex for _ in kwargs_list]
+        for job_id in job_ids:
+            jobs[job_id] = {
+                'job_id': job_id,
+                'task': task,
+                'status': 'queued',
+                'progress': 0.0,
+                'created': time.time(),
+                'finished': None
+            }
+    
+    def on_done(job_id, future):
+        try:
+            response = future.result()
+        except Exception as e:
+            update = {'status': 'failed', 'error': str(e)}
+        else:
+            update = {'status': 'done', 'progress': 1.0, 'result': response}
+            # The job finished either way; a failure here only costs a re-render
+            try:
+                if on_result is not None:
+                    on_result(response)
+                if cache_key is not None:
+                    result_cache.put(cache_key, response['filename'], response)
+            except Exception as e:
+                print(f"⚠ Recording the result of job {job_id} failed: {e}")
+        
+        with jobs_lock:
+            jobs[job_id].update(update, finished=time.time())
+    
+    submitted = []
+    try:
+        for job_id, kwargs in zip(job_ids, kwargs_list):
+            future = _submit_to_pool(_run_job, job_id, task, kwargs)
+            future.add_done_callback(lambda future, job_id=job_id: on_done(job_id, future))
+            submitted.append((job_id, future))
+    except Exception:
+        # Free the queue slots of runs that never reached the pool
+        with jobs_lock:
+            for job_id in job_ids[len(submitted):]:
+                jobs.pop(job_id, None)
+        raise
+    return submitted
+
+def submit_job(task, kwargs, cache_key=None, on_result=None):
+    """Queue a pipeline run and return its job id, or None if the queue is full"""
+    submitted = submit_jobs(task, [kwargs], cache_key, on_result)
+    return submitted[0][0] if submitted is not None else None
+
+def job_status(job_id):
+    """Snapshot of a job's public fields, or None if unknown"""
+    with jobs_lock:
+        job = jobs.get(job_id)
+        if job is None:
+            return None
+        return {key: value for key, value in job.items() if key != 'finished'}
+
+# Uploads: request files are decoded straight from memory, or from an
+# anonymous temp file once they pass UPLOAD_SPOOL_THRESHOLD
+
+class SpooledRequest(Request):
+    """Request whose file uploads are spooled with a configurable memory limit"""
+    
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        # Rolled-over files are unlinked on creation, so nothing is left behind
+        return tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_THRESHOLD, mode='rb+',
+                                             dir=UPLOAD_FOLDER, prefix='upload_')
+
+app.request_class = SpooledRequest
+
+def hash_stream(stream, chunk_size=1024 * 1024):
+    """sha256 hex digest of a seekable stream, read in chunks"""
+    digest = hashlib.sha256()
+    stream.seek(0)
+    for chunk in iter(lambda: stream.read(chunk_size), b''):
+        digest.update(chunk)
+    stream.seek(0)
+    return digest.hexdigest()
+
+# Small uploads seen once: upload_id -> (bytes, record), least recently used first
+memory_uploads = OrderedDict()
+memory_uploads_bytes = 0
+memory_uploads_lock = threading.Lock()
+
+def _persist_upload(stream, record):
+    """Write an upload to UPLOAD_FOLDER and add it to upload_store"""
+    fd, tmp_path = tempfile.mkstemp(prefix='upload_', suffix=record['extension'], dir=UPLOAD_FOLDER)
+    with timed('upload'), os.fdopen(fd, 'wb') as f:
+        stream.seek(0)
+        shutil.copyfileobj(stream, f, 1024 * 1024)
+    count_bytes('upload', os.path.getsize(tmp_path))
+    stream.seek(0)
+    os.replace(tmp_path, os.path.join(UPLOAD_FOLDER, record['filename']))
+    upload_store.put(record['upload_id'], record['filename'], record)
+
+def _take_memory_upload(upload_id):
+    """Move a reused in-memory upload to disk; returns its record or None"""
+    global memory_uploads_bytes
+    with memory_uploads_lock:
+        entry = memory_uploads.pop(upload_id, None)
+        if entry is not None:
+            memory_uploads_bytes -= len(entry[0])
+    if entry is None:
+        return None
+    data, record = entry
+    _persist_upload(io.BytesIO(data), record)
+    return record
+
+def store_upload(stream, extension, original_filename):
+    """Keep an upload under its content hash
+    
+    Returns (upload_id, record). Uploads up to UPLOAD_SPOOL_THRESHOLD are
+    kept in memory the first time and written to upload_store only once
+    they are reused, by upload_id or by sending the same bytes again, so
+    one-off requests cost no disk writes. Reuse also keeps any analysis
+    already recorded for them.
+    """
+    global memory_uploads_bytes
+    with timed('upload'):
+        upload_id = hash_stream(stream)
+    record = upload_store.get(upload_id) or _take_memory_upload(upload_id)
+    if record is not None:
+        return upload_id, record
+    
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+    record = {'upload_id': upload_id, 'filename': f'{upload_id}{extension}',
+              'original_filename': original_filename, 'extension': extension, 'size': size}
+    if size > min(UPLOAD_SPOOL_THRESHOLD, UPLOAD_MEMORY_MAX_BYTES):
+        _persist_upload(stream, record)
+        return upload_id, record
+    
+    with timed('upload'):
+        data = stream.read()
+    stream.seek(0)
+    with memory_uploads_lock:
+        memory_uploads[upload_id] = (data, record)
+        memory_uploads_bytes += size
+        while memory_uploads_bytes > UPLOAD_MEMORY_MAX_BYTES:
+            evicted, _ = memory_uploads.popitem(last=False)[1]
+            memory_uploads_bytes -= len(evicted)
+    return upload_id, record
+
+def find_upload(upload_id):
+    """Return (path, record) for an upload id, writing it to disk if it was in memory, or (None, None)"""
+    record = upload_store.get(upload_id) or _take_memory_upload(upload_id)
+    if record is None:
+        return None, None
+    return os.path.join(UPLOAD_FOLDER, record['filename']), record
+
+def update_upload(upload_id, **fields):
+    """Merge analysis results into an upload's record, on disk or in memory"""
+    with memory_uploads_lock:
+        entry = memory_uploads.get(upload_id)
+        if entry is not None:
+            entry[1].update(fields)
+            return
+    record = upload_store.get(upload_id)
+    if record is not None:
+        upload_store.update(upload_id, dict(record, **fields))
+
+# Streaming formats: generated WAVs are encoded with libsndfile on first
+# request for a format and served from transcode_cache afterwards
+STREAM_FORMATS = {
+    'wav': {'mimetype': 'audio/wav', 'extension': '.wav'},
+    'flac': {
+        'mimetype': 'audio/flac',
+        'extension': '.flac',
+        'format': 'FLAC',
+        'subtype': 'PCM_16'
+    },
+    'mp3': {
+        'mimetype': 'audio/mpeg',
+        'extension': '.mp3',
+        'format': 'MP3',
+        'subtype': 'MPEG_LAYER_III'
+    },
+    'opus': {
+        'mimetype': 'audio/ogg',
+        'extension': '.opus',
+        'format': 'OGG',
+        'subtype': 'OPUS',
+        'sample_rates': (8000, 12000, 16000, 24000, 48000)
+    }
+}
+
+transcode_locks = {}
+transcode_locks_lock = threading.Lock()
+
+def negotiate_stream_format(accept):
+    """Pick a STREAM_FORMATS name from an Accept header, preferring WAV on ties"""
+    by_mimetype = {spec['mimetype']: name for name, spec in STREAM_FORMATS.items()}
+    best = accept.best_match(list(by_mimetype), default='audio/wav')
+    return by_mimetype[best]
+
+def transcode_file(source_path, target_path, fmt):
+    """Encode a WAV into one of STREAM_FORMATS block by block"""
+    spec = STREAM_FORMATS[fmt]
+    info = sf.info(source_path)
+    rate = info.samplerate
+    stages = []
+    
+    # Opus only runs at a few rates; resample to the highest one
+    if 'sample_rates' in spec and rate not in spec['sample_rates']:
+        stages.append(ResampleStage(rate / spec['sample_rates'][-1], info.channels))
+        rate = spec['sample_rates'][-1]
+    
+    with sf.SoundFile(target_path, 'w', samplerate=rate, channels=info.channels,
+                      format=spec['format'], subtype=spec['subtype']) as out:
+        for block in run_stages(read_blocks(source_path, STREAM_BLOCK_SIZE), stages):
+            out.write(np.clip(block, -1.0, 1.0).T)
+
+def transcoded_path(source_path, filename, fmt):
+    """Path of an encoded variant of a generated file, encoding it on a cache miss"""
+    stat = os.stat(source_path)
+    key = make_cache_key('transcode', {
+        'filename': filename,
+        'format': fmt,
+        'size': stat.st_size,
+        'mtime': stat.st_mtime
+    })
+    target_name = f"{os.path.splitext(filename)[0]}_{key[:12]}{STREAM_FORMATS[fmt]['extension']}"
+    
+    # Players issue several range requests at once; encode each variant once
+    with transcode_locks_lock:
+        lock = transcode_locks.setdefault(key, threading.Lock())
+    with lock:
+        if transcode_cache.get(key) is None:
+            fd, tmp_path = tempfile.mkstemp(suffix=STREAM_FORMATS[fmt]['extension'], dir=TRANSCODE_FOLDER)
+            os.close(fd)
+            try:
+                with timed('transcode'):
+                    transcode_file(source_path, tmp_path, fmt)
+                os.replace(tmp_path, os.path.join(TRANSCODE_FOLDER, target_name))
+            except Exception:
+                _remove_files([tmp_path])
+                raise
+            transcode_cache.put(key, target_name, {'source': filename, 'format': fmt})
+    with transcode_locks_lock:
+        transcode_locks.pop(key, None)
+    
+    return os.path.join(TRANSCODE_FOLDER, target_name)
+
+@app.before_request
+def start_request_instrumentation():
+    """Start the stage timer (and the profiler, when enabled) for this request"""
+    g.request_start = time.perf_counter()
+    _request_state.timer = StageTimer()
+    output_store.start_janitor(OUTPUT_STORE_JANITOR_INTERVAL)
+    if PROFILE_REQUESTS:
+        g.sampler = StackSampler(threading.get_ident(), PROFILE_INTERVAL).start()
+
+@app.after_request
+def finish_request_instrumentation(response):
+    """Record request and stage metrics, add Server-Timing, dump slow profiles"""
+    timer = current_timer()
+    _request_state.timer = None
+    if timer is None:
+        return response
+    
+    elapsed = time.perf_counter() - g.request_start
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.inc('http_requests_total', {'endpoint': endpoint, 'method': request.method,
+                                        'status': str(response.status_code)})
+    metrics.observe('http_request_duration_seconds', {'endpoint': endpoint}, elapsed)
+    for stage, (seconds, nbytes) in timer.stages.items():
+        metrics.observe('pipeline_stage_duration_seconds', {'endpoint': endpoint, 'stage': stage}, seconds)
+        if nbytes:
+            metrics.inc('pipeline_stage_bytes_total', {'endpoint': endpoint, 'stage': stage}, nbytes)
+    
+    if SERVER_TIMING or request.headers.get('X-Timing'):
+        response.headers['Server-Timing'] = timer.server_timing(elapsed)
+    
+    sampler = g.pop('sampler', None)
+    if sampler is not None:
+        sampler.stop()
+        if elapsed >= PROFILE_SLOW_THRESHOLD or request.headers.get('X-Profile'):
+            os.makedirs(PROFILE_FOLDER, exist_ok=True)
+            name = (f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{request.endpoint}_"
+                    f"{int(elapsed * 1000)}ms_{uuid.uuid4().hex[:8]}.folded")
+            sampler.dump(os.path.join(PROFILE_FOLDER, name))
+            response.headers['X-Profile-File'] = name
+    
+    return response
+
+@app.teardown_request
+def clear_request_instrumentation(exc):
+    """Stop a profiler left running by a request that raised"""
+    _request_state.timer = None
+    sampler = g.pop('sampler', None)
+    if sampler is not None:
+        sampler.stop()
+
+@app.route('/api/health', methods=['GET'])
+def health_check():
+    """Health check endpoint"""
+    return jsonify({'status': 'ok', 'message': 'AI Music Generator is running'})
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    """Usage and hit rates of the in-process and on-disk caches"""
+    return jsonify({
+        'notes': note_cache.stats(),
+        'results': result_cache.stats(),
+        'uploads': upload_store.stats(),
+        'transcodes': transcode_cache.stats(),
+        'outputs': output_store.stats()
+    })
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus metrics: request and stage latency, cache hit rates, job queue"""
+    caches = {
+        'notes': note_cache.stats(),
+        'results': result_cache.stats(),
+        'uploads': upload_store.stats(),
+        'transcodes': transcode_cache.stats(),
+        'outputs': output_store.stats()
+    }
+    with jobs_lock:
+        statuses = [job['status'] for job in jobs.values()]
+    
+    def per_cache(field):
+        return [({'cache': name}, stats[field]) for name, stats in caches.items()]
+    
+    text = metrics.render([
+        ('cache_hits_total', 'counter', 'Cache lookups that found an entry', per_cache('hits')),
+        ('cache_misses_total', 'counter', 'Cache lookups that missed', per_cache('misses')),
+        ('cache_hit_ratio', 'gauge', 'Hits over lookups since start', per_cache('hit_rate')),
+        ('cache_entries', 'gauge', 'Entries currently cached', per_cache('entries')),
+        ('cache_bytes', 'gauge', 'Bytes currently cached', per_cache('bytes')),
+        ('job_queue_depth', 'gauge', 'Background jobs queued or running',
+         [({}, sum(1 for status in statuses if status in ('queued', 'running')))]),
+        ('job_queue_limit', 'gauge', 'Pending jobs accepted before returning 429', [({}, JOB_QUEUE_DEPTH)]),
+        ('jobs', 'gauge', 'Tracked background jobs by status',
+         [({'status': status}, statuses.count(status)) for status in ('queued', 'running', 'done', 'failed')]),
+        ('app_import_seconds', 'gauge', 'Time taken to import the app module', [({}, IMPORT_SECONDS)]),
+        ('lazy_import_seconds', 'gauge', 'Time taken by deferred imports, on first use',
+         [({'module': name}, seconds) for name, seconds in lazy_import_seconds.items()]),
+        ('warmup_seconds', 'gauge', 'Time spent preloading each WARMUP target',
+         [({'target': target}, seconds) for target, seconds in warmup_seconds.items()])
+    ])
+    return text, 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+@app.route('/api/moods', methods=['GET'])
+def get_moods():
+    """Get available moods"""
+    moods = list(MOOD_PRESETS.keys())
+    return jsonify({'moods': moods})
+
+@app.route('/api/genres', methods=['GET'])
+def get_genres():
+    """Get available genres"""
+    genres = list(GENRE_PRESETS.keys())
+    return jsonify({'genres': genres})
+
+@app.route('/api/mood-transforms', methods=['GET'])
+@app.route('/api/mood-transforms/<source>/<target>', methods=['GET'])
+def get_mood_transforms(source=None, target=None):
+    """Compiled mood-transform plans, all pairs or one (?sample_rate= defaults to SAMPLE_RATE)"""
+    try:
+        sample_rate = int(request.args.get('sample_rate', SAMPLE_RATE))
+        if not 8000 <= sample_rate <= 192000:
+            return jsonify({'error': 'sample_rate must be between 8000 and 192000'}), 400
+        # Inspection never grows the cache; only real audio rates are compiled into it
+        if source is None:
+            return jsonify({'plans': [mood_transform_plan(source_mood, target_mood, sample_rate, cache=False)
+                                      for source_mood in MOOD_PRESETS for target_mood in MOOD_PRESETS]})
+        if source not in MOOD_PRESETS or target not in MOOD_PRESETS:
+            return jsonify({'error': 'Unknown mood'}), 404
+        return jsonify(mood_transform_plan(source, target, sample_rate, cache=False))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/generate', methods=['POST'])
+def generate_music():
     """Generate music based on mood and genre"""
     try:
         data = request.json
         mood = data.get('mood', 'happy')
         genre = data.get('genre', 'electronic')
         duration = int(data.get('duration', 10))
-        tempo = int(data.get('tempo', 120))
+        tempo = int(data['tempo']) if 'tempo' in data else None
+        run_async = bool(data.get('async', False))
         
         # Validate inputs
         if mood not in MOOD_PRESETS:
@@ -444,47 +3224,194 @@ def generate_music():
         # Limit duration
         duration = min(duration, 30)
         
-        # Get presets
-        mood_preset = MOOD_PRESETS[mood]
-        genre_preset = GENRE_PRESETS[genre]
+        # Client-supplied seeds make the request reproducible and cacheable;
+        # otherwise pick a fresh seed and report it so the track can be re-rendered
+        cacheable = data.get('seed') is not None
+        seed = int(data['seed']) if cacheable else random.SystemRandom().randrange(2 ** 32)
+        key = make_cache_key('generate', {
+            'mood': mood,
+            'genre': genre,
+            'duration': duration,
+            'tempo': tempo,
+            'seed': seed
+        })
+        cache_key = key if cacheable else None
+        if cache_key is not None:
+            cached = result_cache.get(cache_key)
+            if cached is not None:
+                return jsonify(dict(cached, cached=True))
         
-        # Adjust tempo based on mood if not specified
-        if 'tempo' not in data:
-            tempo_min, tempo_max = mood_preset['tempo_range']
-            tempo = random.randint(tempo_min, tempo_max)
+        # Content-addressed filename: the parameters and seed fix the audio
+        filename = f'generated_{mood}_{genre}_{key[:16]}.wav'
         
-        # Generate melody
-        melody = generate_melody(mood_preset, genre_preset, duration, tempo)
+        kwargs = {
+            'mood': mood,
+            'genre': genre,
+            'duration': duration,
+            'tempo': tempo,
+            'seed': seed,
+            'filename': filename
+        }
         
-        # Add bass line
-        bass = add_bass_line(melody, mood_preset, genre_preset, tempo)
+        if run_async:
+            job_id = submit_job('generate', kwargs, cache_key)
+            if job_id is None:
+                return jsonify({'error': 'Job queue is full, try again later'}), 429
+            return jsonify({'success': True, 'job_id': job_id, 'status': 'queued'}), 202
         
-        # Mix melody and bass
-        music = melody.overlay(bass)
+        response = process_generate(**kwargs)
+        if cache_key is not None:
+            result_cache.put(cache_key, filename, response)
         
-        # Apply effects
-        effects = genre_preset['effects']
-        music = apply_effects(music, effects, mood_preset)
+        return jsonify(response)
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def parse_batch_spec(spec):
+    """Validate one spec of a batch; returns (params, cacheable)"""
+    if not isinstance(spec, dict) or set(spec) - {'mood', 'genre', 'duration', 'tempo', 'seed'}:
+        raise ValueError('each spec is an object with mood, genre, duration, tempo and/or seed')
+    mood = spec.get('mood', 'happy')
+    genre = spec.get('genre', 'electronic')
+    if not isinstance(mood, str) or mood not in MOOD_PRESETS:
+        raise ValueError('invalid mood')
+    if not isinstance(genre, str) or genre not in GENRE_PRESETS:
+        raise ValueError('invalid genre')
+    
+    cacheable = spec.get('seed') is not None
+    params = {
+        'mood': mood,
+        'genre': genre,
+        'duration': min(int(spec.get('duration', 10)), 30),
+        'tempo': int(spec['tempo']) if spec.get('tempo') is not None else None,
+        'seed': int(spec['seed']) if cacheable else random.SystemRandom().randrange(2 ** 32)
+    }
+    if params['duration'] < 1 or (params['tempo'] is not None and params['tempo'] <= 0):
+        raise ValueError('duration and tempo must be positive')
+    return params, cacheable
+
+@app.route('/api/generate/batch', methods=['POST'])
+def generate_music_batch():
+    """Generate many mood/genre/duration variants in one call
+    
+    Identical specs are rendered once and seeded ones come from the result
+    cache when possible. The rest are split across the worker pool grouped
+    by mood and tempo, so each worker reuses its bass renders.
+    """
+    try:
+        data = request.json
+        specs = data.get('specs')
+        if not isinstance(specs, list) or not specs:
+            return jsonify({'error': 'specs must be a non-empty list'}), 400
+        if len(specs) > BATCH_MAX_SPECS:
+            return jsonify({'error': f'At most {BATCH_MAX_SPECS} specs per batch'}), 400
         
-        # Normalize audio
-        music = music.normalize()
+        items = []
+        for index, spec in enumerate(specs):
+            try:
+                params, cacheable = parse_batch_spec(spec)
+            except (ValueError, TypeError) as e:
+                return jsonify({'error': f'Invalid spec {index}: {e}'}), 400
+            
+            # Same key and file name as /api/generate, so the two share cache entries
+            cache_key = make_cache_key('generate', params)
+            items.append({
+                'kwargs': dict(params, filename=f"generated_{params['mood']}_{params['genre']}_{cache_key[:16]}.wav"),
+                'cache_key': cache_key,
+                'cacheable': cacheable
+            })
         
-        # Generate filename
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f'generated_{mood}_{genre}_{timestamp}.wav'
-        filepath = os.path.join(GENERATED_FOLDER, filename)
+        results = [None] * len(items)
+        pending = OrderedDict()
+        for index, item in enumerate(items):
+            if item['cacheable']:
+                cached = result_cache.get(item['cache_key'])
+                if cached is not None:
+                    results[index] = dict(cached, cached=True)
+                    continue
+            pending.setdefault(item['cache_key'], item)
         
-        # Export audio
-        music.export(filepath, format='wav')
+        # Contiguous chunks of the sorted list keep mood/tempo groups together
+        queue = sorted(pending.values(), key=lambda item: (
+            item['kwargs']['mood'],
+            resolve_tempo(item['kwargs']['mood'], item['kwargs']['tempo'], item['kwargs']['seed'])
+        ))
+        size = max(1, -(-len(queue) // min(JOB_WORKERS, JOB_QUEUE_DEPTH)))
+        chunks = [queue[i:i + size] for i in range(0, len(queue), size)]
         
-        return jsonify({
-            'success': True,
-            'filename': filename,
-            'mood': mood,
-            'genre': genre,
-            'tempo': tempo,
-            'duration': duration
-        })
+        # Each chunk is a background job, so batches count against JOB_QUEUE_DEPTH
+        submitted = submit_jobs('generate_batch', [{'items': [item['kwargs'] for item in chunk]}
+                                                   for chunk in chunks])
+        if submitted is None:
+            return jsonify({'error': 'Job queue is full, try again later'}), 429
+        
+        rendered = {}
+        for chunk, (_, future) in zip(chunks, submitted):
+            for item, response in zip(chunk, future.result()):
+                rendered[item['cache_key']] = response
+                if item['cacheable']:
+                    result_cache.put(item['cache_key'], response['filename'], response)
+        
+        for index, item in enumerate(items):
+            if results[index] is None:
+                results[index] = rendered[item['cache_key']]
+        
+        payload = {'success': True, 'count': len(results), 'results': results}
+        
+        # Optionally bundle every file into one uncompressed zip
+        if data.get('archive'):
+            filenames = sorted({result['filename'] for result in results})
+            archive_key = make_cache_key('batch', filenames)
+            archive_name = f'batch_{archive_key[:16]}.zip'
+            if result_cache.get(archive_key) is None:
+                with zipfile.ZipFile(os.path.join(GENERATED_FOLDER, archive_name), 'w',
+                                     zipfile.ZIP_STORED) as archive:
+                    for filename in filenames:
+                        archive.write(os.path.join(GENERATED_FOLDER, filename), filename)
+                output_store.register(archive_name, 'archive', {'files': filenames})
+                result_cache.put(archive_key, archive_name, {'filename': archive_name})
+            payload['archive'] = archive_name
+        
+        return jsonify(payload)
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/generate/stream', methods=['GET', 'POST'])
+def generate_music_stream():
+    """Generate music and stream it as a WAV while it renders
+    
+    Takes the /api/generate parameters as JSON or query arguments, so the
+    URL can be used directly as an <audio> source.
+    """
+    try:
+        data = request.get_json(silent=True) or request.args
+        mood = data.get('mood', 'happy')
+        genre = data.get('genre', 'electronic')
+        duration = int(data.get('duration', 10))
+        tempo = int(data['tempo']) if data.get('tempo') is not None else None
+        
+        # Validate inputs
+        if mood not in MOOD_PRESETS:
+            return jsonify({'error': 'Invalid mood'}), 400
+        if genre not in GENRE_PRESETS:
+            return jsonify({'error': 'Invalid genre'}), 400
+        
+        # Rendering is progressive, so longer tracks than /api/generate are fine
+        duration = max(1, min(duration, STREAM_GENERATE_MAX_DURATION))
+        
+        if data.get('seed') is not None:
+            seed = int(data['seed'])
+        else:
+            seed = random.SystemRandom().randrange(2 ** 32)
+        
+        tempo, frames, chunks = stream_generate(mood, genre, duration, tempo, seed)
+        response = app.response_class(chunks, mimetype='audio/wav')
+        response.headers['X-Seed'] = str(seed)
+        response.headers['X-Tempo'] = str(tempo)
+        response.headers['X-Frames'] = str(frames)
+        return response
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -493,40 +3420,92 @@ def generate_music():
 def remix_audio():
     """Apply AI-powered remix effects to uploaded audio"""
     try:
-        if 'audio' not in request.files:
+        upload_id = request.form.get('upload_id')
+        if 'audio' not in request.files and not upload_id:
             return jsonify({'error': 'No audio file provided'}), 400
         
-        audio_file = request.files['audio']
-        mood = request.form.get('mood', 'happy')
-        genre = request.form.get('genre', 'electronic')
-        tempo_change = float(request.form.get('tempo_change', 1.0))
-        pitch_shift = int(request.form.get('pitch_shift', 0))
-        add_harmony_layer = request.form.get('add_harmony', 'false').lower() == 'true'
-        harmony_type = request.form.get('harmony_type', 'third')
-        intelligent_transform = request.form.get('intelligent_transform', 'false').lower() == 'true'
-        source_mood = request.form.get('source_mood', 'happy')
+        options = {
+            'mood': request.form.get('mood', 'happy'),
+            'genre': request.form.get('genre', 'electronic'),
+            'pitch_shift': int(request.form.get('pitch_shift', 0)),
+            'add_harmony': request.form.get('add_harmony', 'false').lower() == 'true',
+            'harmony_type': request.form.get('harmony_type', 'third'),
+            'intelligent_transform': request.form.get('intelligent_transform', 'false').lower() == 'true',
+            'source_mood': request.form.get('source_mood', 'happy')
+        }
+        run_async = request.form.get('async', 'false').lower() == 'true'
         
-        # Get original filename and extension
-        original_filename = audio_file.filename
-        file_extension = os.path.splitext(original_filename)[1].lower()
+        try:
+            options['tempo_change'] = parse_tempo_change(request.form.get('tempo_change', 1.0))
+        except ValueError as e:
+            return jsonify({'error': f'Invalid tempo_change: {e}'}), 400
+        
+        # Extra layers mixed over the remix, each rendered in parallel
+        try:
+            options['layers'] = parse_layers(request.form.get('layers', '[]'))
+        except (ValueError, TypeError) as e:
+            return jsonify({'error': f'Invalid layers: {e}'}), 400
+        
+        # Either reuse an earlier upload by id or store this one for later
+        if 'audio' in request.files:
+            audio_file = request.files['audio']
+            file_extension = os.path.splitext(audio_file.filename)[1].lower()
+            upload = audio_file.stream
+            upload_id, record = store_upload(upload, file_extension, audio_file.filename)
+        else:
+            upload_path, record = find_upload(upload_id)
+            if record is None:
+                return jsonify({'error': 'Unknown upload_id'}), 404
+            file_extension = record['extension']
+            upload = upload_path
         
         # Check if FFmpeg is needed for this file type
-        if file_extension not in ['.wav'] and not FFMPEG_AVAILABLE:
+        if file_extension not in ['.wav'] and not ffmpeg_available():
             return jsonify({
                 'error': 'FFmpeg is required for this file format. Please install FFmpeg or use WAV files.',
                 'ffmpeg_required': True,
                 'install_url': 'https://ffmpeg.org/download.html'
             }), 400
         
-        # Save uploaded file
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        upload_filename = f'upload_{timestamp}{file_extension}'
-        upload_path = os.path.join(UPLOAD_FOLDER, upload_filename)
-        audio_file.save(upload_path)
+        # Same audio with the same settings always renders the same remix
+        cache_key = make_cache_key('remix', {
+            'content': upload_id,
+            'extension': file_extension,
+            'form': sorted(item for item in request.form.items() if item[0] not in ('async', 'upload_id'))
+        })
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            return jsonify(dict(cached, cached=True))
+        
+        # Long uploads are remixed block-wise to keep memory bounded
+        size = record['size'] if 'size' in record else os.path.getsize(os.path.join(UPLOAD_FOLDER, record['filename']))
+        options['streaming'] = (request.form.get('streaming', 'false').lower() == 'true'
+                                or size > REMIX_STREAMING_THRESHOLD)
+        
+        kwargs = {
+            'upload': upload,
+            'filename': f"remix_{options['mood']}_{options['genre']}_{cache_key[:16]}.wav",
+            'options': options,
+            'features': record.get('analysis')
+        }
+        
+        def remember(response):
+            response['upload_id'] = upload_id
+            # Streamed remixes only summarize the audio; keep full analyses only
+            if kwargs['features'] is None and not response.get('streaming'):
+                update_upload(upload_id, analysis=response['audio_features'])
+        
+        if run_async:
+            # Worker processes read the stored copy of the upload
+            kwargs['upload'], _ = find_upload(upload_id)
+            job_id = submit_job('remix', kwargs, cache_key, on_result=remember)
+            if job_id is None:
+                return jsonify({'error': 'Job queue is full, try again later'}), 429
+            return jsonify({'success': True, 'job_id': job_id, 'status': 'queued', 'upload_id': upload_id}), 202
         
         # Load audio with better error handling
         try:
-            audio = AudioSegment.from_file(upload_path)
+            response = process_remix(**kwargs)
         except FileNotFoundError as e:
             return jsonify({
                 'error': 'FFmpeg not found. Please install FFmpeg to process audio files.',
@@ -534,128 +3513,113 @@ def remix_audio():
                 'install_url': 'https://ffmpeg.org/download.html',
                 'details': str(e)
             }), 500
+        except subprocess.CalledProcessError:
+            return jsonify({'error': 'Could not decode the audio file'}), 400
+
+        remember(response)
+        result_cache.put(cache_key, kwargs['filename'], response)
         
-        # Analyze original audio features
-        audio_features = analyze_audio_features(audio)
-        
-        # Apply intelligent mood transformation if requested
-        if intelligent_transform:
-            audio = intelligent_mood_transform(audio, source_mood, mood, MOOD_PRESETS)
-        
-        # Apply pitch shift if requested
-        if pitch_shift != 0:
-            audio = pitch_shift_audio(audio, pitch_shift)
-        
-        # Apply tempo change
-        if tempo_change != 1.0:
-            new_sample_rate = int(audio.frame_rate * tempo_change)
-            audio = audio._spawn(audio.raw_data, overrides={'frame_rate': new_sample_rate})
-            audio = audio.set_frame_rate(44100)
-        
-        # Get presets
-        mood_preset = MOOD_PRESETS.get(mood, MOOD_PRESETS['happy'])
-        genre_preset = GENRE_PRESETS.get(genre, GENRE_PRESETS['electronic'])
-        
-        # Apply genre effects
-        effects = genre_preset['effects']
-        audio = apply_effects(audio, effects, mood_preset)
-        
-        # Add harmony layer if requested
-        if add_harmony_layer:
-            audio = add_harmony(audio, harmony_type)
-        
-        # Adjust brightness based on mood
-        brightness = mood_preset['brightness']
-        if brightness < 0.5:
-            audio = audio.low_pass_filter(4000)
-        elif brightness > 0.7:
-            audio = audio.high_pass_filter(150)
-        
-        # Normalize
-        audio = audio.normalize()
-        
-        # Save remixed audio
-        remix_filename = f'remix_{mood}_{genre}_{timestamp}.wav'
-        remix_path = os.path.join(GENERATED_FOLDER, remix_filename)
-        audio.export(remix_path, format='wav')
-        
-        return jsonify({
-            'success': True,
-            'filename': remix_filename,
-            'mood': mood,
-            'genre': genre,
-            'audio_features': audio_features,
-            'applied_effects': {
-                'pitch_shift': pitch_shift,
-                'tempo_change': tempo_change,
-                'harmony': harmony_type if add_harmony_layer else None,
-                'intelligent_transform': intelligent_transform
-            }
-        })
+        return jsonify(response)
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Report status, progress and result of a background job"""
+    job = job_status(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+
 @app.route('/api/analyze', methods=['POST'])
 def analyze_audio():
     """Analyze uploaded audio and suggest creative transformations"""
     try:
-        if 'audio' not in request.files:
+        upload_id = request.form.get('upload_id')
+        if 'audio' not in request.files and not upload_id:
             return jsonify({'error': 'No audio file provided'}), 400
         
-        audio_file = request.files['audio']
-        
-        # Save uploaded file
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        file_extension = os.path.splitext(audio_file.filename)[1].lower()
-        upload_filename = f'analyze_{timestamp}{file_extension}'
-        upload_path = os.path.join(UPLOAD_FOLDER, upload_filename)
-        audio_file.save(upload_path)
-        
-        # Load audio
-        try:
-            audio = AudioSegment.from_file(upload_path)
-        except FileNotFoundError:
-            return jsonify({
-                'error': 'FFmpeg required for this file format',
-                'ffmpeg_required': True
-            }), 500
+        # Store the upload so a later remix can reference it by upload_id
+        if 'audio' in request.files:
+            audio_file = request.files['audio']
+            upload = audio_file.stream
+            upload_id, record = store_upload(
+                upload, os.path.splitext(audio_file.filename)[1].lower(), audio_file.filename)
+        else:
+            upload, record = find_upload(upload_id)
+            if record is None:
+                return jsonify({'error': 'Unknown upload_id'}), 404
         
-        # Analyze features
-        features = analyze_audio_features(audio)
+        # Analysis is only run once per distinct upload
+        features = record.get('analysis')
+        if features is None:
+            try:
+                with timed('decode'):
+                    samples, sample_rate = load_audio(upload)
+            except FileNotFoundError:
+                return jsonify({
+                    'error': 'FFmpeg required for this file format',
+                    'ffmpeg_required': True
+                }), 500
+            except subprocess.CalledProcessError:
+                return jsonify({'error': 'Could not decode the audio file'}), 400
+            count_bytes('decode', samples.nbytes)
+            
+            # Analyze features
+            with timed('analyze'):
+                features = analyze_track(samples, sample_rate)
+            update_upload(upload_id, analysis=features)
+        tempo = features['tempo']
         
-        # Suggest moods based on features
+        # Suggest moods based on tempo, loudness and spectral brightness.
+        # Tempo 0 means no clear beat (drones, pads, noise), which reads as calm
         suggested_moods = []
-        if features['energy'] > 0.6:
+        if not tempo:
+            suggested_moods.append('calm')
+        elif tempo >= 120 or features['energy'] > 0.6:
             suggested_moods.append('energetic')
-        elif features['energy'] < 0.3:
+        elif tempo < 80 or features['energy'] < 0.3:
             suggested_moods.append('calm')
         
         if features['brightness'] < 0.3:
             suggested_moods.append('dark')
-        elif features['brightness'] > 0.5:
+        elif features['brightness'] > 0.6:
             suggested_moods.append('uplifting')
         
-        # Suggest genres
+        # Suggest genres; beatless audio falls through to ambient and classical
         suggested_genres = []
-        if features['energy'] > 0.7:
+        if tempo and (tempo >= 120 or features['energy'] > 0.7):
             suggested_genres.append('rock')
             suggested_genres.append('electronic')
+        elif 80 <= tempo < 120 and features['brightness'] >= 0.3:
+            suggested_genres.append('jazz')
+            suggested_genres.append('electronic')
         else:
             suggested_genres.append('ambient')
             suggested_genres.append('classical')
         
+        def tempo_change_to(target):
+            """Remix tempo_change that moves the detected tempo to target BPM
+            
+            With no detected beat this is 1.0, leaving the suggestions' own
+            minimum changes.
+            """
+            if not tempo:
+                return 1.0
+            return round(float(np.clip(target / tempo, 0.5, 2.0)), 2)
+        
         # Creative suggestions
         suggestions = [
             {
                 'name': 'Energize',
                 'description': 'Speed up and brighten the track',
-                'params': {'tempo_change': 1.2, 'pitch_shift': 2, 'mood': 'energetic'}
+                'params': {'tempo_change': max(tempo_change_to(140), 1.05), 'pitch_shift': 2, 'mood': 'energetic'}
             },
             {
                 'name': 'Chill Out',
                 'description': 'Slow down and add ambient effects',
-                'params': {'tempo_change': 0.8, 'mood': 'calm', 'genre': 'ambient'}
+                'params': {'tempo_change': min(tempo_change_to(75), 0.95), 'mood': 'calm', 'genre': 'ambient'}
             },
             {
                 'name': 'Add Harmony',
@@ -675,35 +3639,140 @@ def analyze_audio():
             'suggested_moods': suggested_moods,
             'suggested_genres': suggested_genres,
             'creative_suggestions': suggestions,
-            'duration': len(audio) / 1000.0
+            'duration': features['duration'],
+            'upload_id': upload_id
         })
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def find_output(filename):
+    """Path of a stored output, or None if the manifest or the disk lacks it"""
+    entry = output_store.lookup(filename)
+    if entry is None:
+        return None
+    path = os.path.join(GENERATED_FOLDER, entry['filename'])
+    if not os.path.isfile(path):
+        # Deleted outside the store, e.g. by hand
+        output_store.remove(filename)
+        return None
+    return path
+
+@app.route('/api/outputs', methods=['GET'])
+def list_outputs():
+    """Stored outputs, newest first, paged with ?before=<next of the previous page>"""
+    try:
+        limit = min(int(request.args.get('limit', 50)), 500)
+        before = request.args.get('before')
+        if before is not None:
+            # Cursor is "<created>:<filename>" of the previous page's last entry
+            created, _, filename = before.partition(':')
+            before = (float(created), filename)
+        entries = output_store.list(request.args.get('kind'), before, limit)
+        last = entries[-1] if len(entries) == limit else None
+        return jsonify({
+            'outputs': entries,
+            'next': f"{last['created']!r}:{last['filename']}" if last else None
+        })
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/download/<filename>', methods=['GET'])
 def download_file(filename):
     """Download generated audio file"""
     try:
-        filepath = os.path.join(GENERATED_FOLDER, filename)
-        if os.path.exists(filepath):
-            return send_file(filepath, as_attachment=True)
-        else:
+        filepath = find_output(filename)
+        if filepath is None:
             return jsonify({'error': 'File not found'}), 404
+        return send_mapped(filepath, as_attachment=True)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/stream/<filename>', methods=['GET'])
 def stream_file(filename):
-    """Stream audio file"""
+    """Stream audio file with Range and conditional GET support
+    
+    ?format=wav|flac|mp3|opus selects an encoding; without it the Accept
+    header decides and WAV is the default.
+    """
     try:
-        filepath = os.path.join(GENERATED_FOLDER, filename)
-        if os.path.exists(filepath):
-            return send_file(filepath, mimetype='audio/wav')
-        else:
+        filepath = find_output(filename)
+        if filepath is None:
             return jsonify({'error': 'File not found'}), 404
+        
+        fmt = request.args.get('format')
+        negotiated = fmt is None
+        if negotiated:
+            fmt = negotiate_stream_format(request.accept_mimetypes)
+        if fmt not in STREAM_FORMATS:
+            return jsonify({'error': f'Unsupported format: {fmt}',
+                            'formats': list(STREAM_FORMATS)}), 400
+        
+        if fmt != 'wav':
+            filepath = transcoded_path(filepath, filename, fmt)
+        
+        # Answers Range with 206 and If-None-Match/If-Modified-Since with 304
+        response = send_mapped(filepath, mimetype=STREAM_FORMATS[fmt]['mimetype'])
+        response.headers['Accept-Ranges'] = 'bytes'
+        if negotiated:
+            response.vary.add('Accept')
+        return response
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Warm-up: run each configured endpoint's pipeline once on a short silent
+# buffer so lazy imports, FFmpeg probing and first-call costs happen before
+# the first real request
+
+def _warm_generate():
+    score, _ = compose_score('happy', 'electronic', 1, 120, 0)
+    apply_effects(render_score(score)[np.newaxis, :], ['reverb', 'filter', 'distortion'], MOOD_PRESETS['happy'])
+
+def _warm_remix():
+    ffmpeg_available()
+    options = {
+        'mood': 'sad',
+        'genre': 'electronic',
+        'tempo_change': 1.1,
+        'pitch_shift': 2,
+        'add_harmony': True,
+        'harmony_type': 'third',
+        'intelligent_transform': True,
+        'source_mood': 'happy'
+    }
+    process_buffer(np.zeros((2, SAMPLE_RATE), dtype=np.float32), build_remix_stages(options, SAMPLE_RATE, 2))
+
+def _warm_analyze():
+    analyze_track(np.zeros((1, SAMPLE_RATE), dtype=np.float32), SAMPLE_RATE)
+
+WARMUP_TARGETS = {
+    'generate': _warm_generate,
+    'remix': _warm_remix,
+    'analyze': _warm_analyze
+}
+
+warmup_seconds = {}
+
+def warm_up(targets):
+    """Preload what the named endpoints need, recording the time each took"""
+    if 'all' in targets:
+        targets = list(WARMUP_TARGETS)
+    for target in targets:
+        if target not in WARMUP_TARGETS:
+            print(f"⚠ Unknown WARMUP target: {target}")
+            continue
+        started = time.perf_counter()
+        WARMUP_TARGETS[target]()
+        warmup_seconds[target] = time.perf_counter() - started
+        print(f"✓ Warmed up {target} in {warmup_seconds[target]:.2f}s")
+
+IMPORT_SECONDS = time.perf_counter() - IMPORT_STARTED
+print(f"✓ App imported in {IMPORT_SECONDS:.2f}s")
+
+warm_up([target.strip() for target in WARMUP.split(',') if target.strip()])
+
 if __name__ == '__main__':
+    ffmpeg_available()
     app.run(debug=True, port=5000)
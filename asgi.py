@@ -0,0 +1,223 @@
+"""
+Production serving mode: the Flask app behind an ASGI server
+
+Request bodies are received on the event loop and spooled (in memory up to
+UPLOAD_SPOOL_THRESHOLD, then to a temp file) before a view runs, and
+response bodies are sent chunk by chunk as fast as the client takes them.
+A slow client therefore costs a socket but never a thread. A pool of
+HANDLER_THREADS threads runs the Flask views and produces each response
+chunk, and the views still hand background jobs to the process pool.
+
+ENDPOINT_LIMITS caps how many requests each route runs at once, as a
+comma-separated list of rule=limit. Requests over a limit wait on the
+event loop and get a 503 after ENDPOINT_QUEUE_TIMEOUT seconds.
+
+Usage:
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+"""
+
+import asyncio
+import json
+import os
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from werkzeug.exceptions import HTTPException
+
+from app import app as flask_app, UPLOAD_FOLDER, UPLOAD_SPOOL_THRESHOLD
+
+# Threads running Flask views and producing response chunks
+HANDLER_THREADS = int(os.environ.get('HANDLER_THREADS', 32))
+
+# Most requests each route runs at once (routes not listed are only bounded
+# by HANDLER_THREADS) and how long a request waits for a slot
+ENDPOINT_LIMITS = os.environ.get('ENDPOINT_LIMITS', '/api/generate=4,/api/generate/batch=1,'
+                                 '/api/generate/stream=4,/api/remix=2,/api/analyze=4')
+ENDPOINT_QUEUE_TIMEOUT = float(os.environ.get('ENDPOINT_QUEUE_TIMEOUT', 30))
+
+def parse_limits(text):
+    """Parse 'rule=limit,...' into {rule: limit}"""
+    limits = {}
+    for item in text.split(','):
+        if item.strip():
+            rule, _, limit = item.partition('=')
+            limits[rule.strip()] = int(limit)
+    return limits
+
+class EndpointLimiter:
+    """Per-route semaphores; requests queue on the event loop, not in threads"""
+
+    def __init__(self, url_map, limits):
+        self.adapter = url_map.bind('localhost')
+        self.slots = {rule: asyncio.Semaphore(limit) for rule, limit in limits.items() if limit > 0}
+
+    def rule(self, path, method):
+        """URL rule a request will be routed to, or None"""
+        try:
+            rule, _ = self.adapter.match(path, method, return_rule=True)
+        except HTTPException:
+            return None
+        return rule.rule
+
+    @asynccontextmanager
+    async def slot(self, path, method):
+        """Hold a slot of the request's route; yields False if none freed up in time"""
+        semaphore = self.slots.get(self.rule(path, method))
+        if semaphore is None:
+            yield True
+            return
+
+        try:
+            await asyncio.wait_for(semaphore.acquire(), ENDPOINT_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            semaphore.release()
+
+executor = ThreadPoolExecutor(max_workers=HANDLER_THREADS, thread_name_prefix='handler')
+limiter = EndpointLimiter(flask_app.url_map, parse_limits(ENDPOINT_LIMITS))
+
+async def receive_body(receive):
+    """Spool the request body as it arrives; returns (file, length), or (None, 0) if the client left"""
+    body = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_THRESHOLD, mode='w+b',
+                                         dir=UPLOAD_FOLDER, prefix='upload_')
+    length = 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            body.close()
+            return None, 0
+        chunk = message.get('body', b'')
+        body.write(chunk)
+        length += len(chunk)
+        if not message.get('more_body', False):
+            break
+    body.seek(0)
+    return body, length
+
+def build_environ(scope, body, length):
+    """WSGI environ for an ASGI HTTP scope whose body has been received"""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'CONTENT_LENGTH': str(length),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False
+    }
+
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'CONTENT_LENGTH':  # the received length is authoritative
+            key = f'HTTP_{name}'
+            environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+async def send_json(send, status, payload, headers=()):
+    body = json.dumps(payload).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode()),
+                    (b'access-control-allow-origin', b'*'), *headers]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+async def run_wsgi(scope, body, length, receive, send):
+    """Run the Flask app on the handler pool, sending its chunks as the client accepts them"""
+    loop = asyncio.get_running_loop()
+    environ = build_environ(scope, body, length)
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started['status'] = int(status.split(' ', 1)[0])
+        # ASGI servers add their own Date header
+        started['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                              for name, value in headers if name.lower() != 'date']
+        return lambda data: None  # Flask never uses the legacy write() callable
+
+    def call_app():
+        # start_response may be deferred until the first chunk is produced
+        iterable = flask_app(environ, start_response)
+        chunks = iter(iterable)
+        return iterable, chunks, next(chunks, None)
+
+    iterable, chunks, chunk = await loop.run_in_executor(executor, call_app)
+
+    # Stop producing chunks (e.g. rendering a stream) once the client is gone
+    disconnected = asyncio.Event()
+
+    async def watch_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+        disconnected.set()
+
+    watcher = asyncio.create_task(watch_disconnect())
+    try:
+        await send({'type': 'http.response.start', 'status': started['status'], 'headers': started['headers']})
+        while chunk is not None and not disconnected.is_set():
+            if chunk:
+                # Waits for the transport to drain, so slow readers hold no thread
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            chunk = await loop.run_in_executor(executor, next, chunks, None)
+        if not disconnected.is_set():
+            await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        watcher.cancel()
+        if hasattr(iterable, 'close'):
+            await loop.run_in_executor(executor, iterable.close)
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            executor.shutdown(wait=False, cancel_futures=True)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def app(scope, receive, send):
+    """ASGI entry point"""
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    # Uploads are fully received before taking a slot, so slow senders
+    # don't keep DSP-bound routes busy
+    body, length = await receive_body(receive)
+    if body is None:
+        return
+    try:
+        async with limiter.slot(scope['path'], scope['method']) as admitted:
+            if not admitted:
+                await send_json(send, 503, {'error': 'Server busy, try again later'},
+                                [(b'retry-after', str(int(ENDPOINT_QUEUE_TIMEOUT)).encode())])
+                return
+            await run_wsgi(scope, body, length, receive, send)
+    finally:
+        body.close()
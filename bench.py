@@ -0,0 +1,390 @@
+"""
+Benchmark suite for the generate, remix and analyze pipelines
+
+Synthesizes deterministic test audio, times each stage function and each
+endpoint (through Flask's test client), records peak Python memory and
+writes the results as JSON. Runs fully offline in a scratch directory,
+so the project's uploads/ and generated/ folders are left alone.
+
+Usage:
+    python bench.py                                  # write bench_results.json
+    python bench.py --quick                          # 5 second inputs only
+    python bench.py --output bench_baseline.json     # save a baseline
+    python bench.py --baseline bench_baseline.json   # compare, exit 1 on regressions
+"""
+
+import argparse
+import atexit
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import soundfile as sf
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SAMPLE_RATE = 44100
+DEFAULT_LENGTHS = (5, 30)
+DEFAULT_CHANNELS = (1, 2)
+
+# Slowdowns below this many seconds are treated as timer noise
+NOISE_FLOOR = 0.001
+
+# Largest error allowed when metering the reference tone, in LU
+LOUDNESS_TOLERANCE = 0.1
+
+# Largest tempo error allowed on the kick tracks, in BPM
+TEMPO_TOLERANCE = 1.0
+
+# Remix settings that exercise every stage of the pipeline
+REMIX_FORM = {
+    'mood': 'sad',
+    'genre': 'electronic',
+    'tempo_change': '1.1',
+    'pitch_shift': '2',
+    'add_harmony': 'true',
+    'harmony_type': 'third',
+    'intelligent_transform': 'true',
+    'source_mood': 'happy'
+}
+
+def synth_input(seconds, channels, sample_rate=SAMPLE_RATE, seed=0):
+    """Deterministic test signal: a sustained chord plus decaying noise hits at 120 BPM"""
+    rng = np.random.default_rng(seed)
+    frames = int(seconds * sample_rate)
+    t = np.arange(frames) / sample_rate
+    samples = np.zeros((channels, frames))
+
+    for channel in range(channels):
+        # Detune each channel slightly so stereo inputs aren't dual mono
+        for frequency in (220.0, 277.18, 329.63):
+            samples[channel] += 0.2 * np.sin(2 * np.pi * frequency * (1 + 0.001 * channel) * t)
+
+    hit_length = int(0.1 * sample_rate)
+    envelope = np.exp(-np.arange(hit_length) / (0.02 * sample_rate))
+    for onset in range(0, frames - hit_length, sample_rate // 2):
+        samples[:, onset:onset + hit_length] += 0.5 * envelope * rng.standard_normal((channels, hit_length))
+
+    samples *= 0.9 / np.max(np.abs(samples))
+    return samples.astype(np.float32)
+
+def wav_bytes(samples, sample_rate=SAMPLE_RATE):
+    """Encode a (channels, frames) buffer as 16-bit WAV"""
+    buffer = io.BytesIO()
+    sf.write(buffer, samples.T, sample_rate, format='WAV', subtype='PCM_16')
+    return buffer.getvalue()
+
+def stage_cases(backend, seconds, channels):
+    """(name, run, reset) for every stage function on one input"""
+    label = f'{seconds}s/{channels}ch'
+    samples = synth_input(seconds, channels)
+    happy, sad = backend.MOOD_PRESETS['happy'], backend.MOOD_PRESETS['sad']
+    remix_options = {
+        'mood': 'sad',
+        'genre': 'electronic',
+        'tempo_change': 1.1,
+        'pitch_shift': 2,
+        'add_harmony': True,
+        'harmony_type': 'third',
+        'intelligent_transform': True,
+        'source_mood': 'happy'
+    }
+
+    return [
+        (f'apply_effects[{label}]', lambda: backend.apply_effects(samples, ['reverb', 'filter'], happy), None),
+        (f'pitch_shift[{label}]', lambda: backend.pitch_shift(samples, 2), None),
+        (f'time_stretch[{label}]', lambda: backend.time_stretch(samples, 1.1), None),
+        (f'mood_transform[{label}]', lambda: backend.process_buffer(
+            samples, backend.mood_transform_stages(happy, sad, SAMPLE_RATE, channels)), None),
+        (f'add_harmony[{label}]', lambda: backend.mix_layers(
+            samples, [backend.harmony_stages('third', channels)]), None),
+        (f'remix_stages[{label}]', lambda: backend.process_buffer(
+            samples, backend.build_remix_stages(remix_options, SAMPLE_RATE, channels)), None),
+        (f'analyze_audio_features[{label}]', lambda: backend.analyze_audio_features(samples), None),
+        (f'analyze_track[{label}]', lambda: backend.analyze_track(samples, SAMPLE_RATE), None)
+    ]
+
+def loudness_checks(backend, lengths=(0.1, 0.25, 0.35, 1.0, 5.0)):
+    """Meter a -23 LUFS 997 Hz tone at several lengths; returns (seconds, error) pairs
+
+    A full-scale 997 Hz sine on one channel reads -3.01 LUFS (BS.1770), so
+    the reference amplitude is known without metering. Lengths under one
+    400 ms gating block take the meter's short-input path.
+    """
+    amplitude = 10 ** ((-23.0 + 3.01) / 20)
+    errors = []
+    for seconds in lengths:
+        t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+        tone = (amplitude * np.sin(2 * np.pi * 997 * t)).astype(np.float32)[np.newaxis]
+        meter = backend.LoudnessMeter(SAMPLE_RATE, 1)
+        meter.process(tone)
+        errors.append((seconds, meter.integrated() + 23.0))
+    return errors
+
+def kick_track(bpm, seconds=10, sample_rate=SAMPLE_RATE, seed=0):
+    """Decaying 50 Hz kicks at bpm over a -40 dB noise floor"""
+    rng = np.random.default_rng(seed)
+    samples = 0.01 * rng.standard_normal(int(seconds * sample_rate))
+    length = int(0.5 * sample_rate)
+    t = np.arange(length) / sample_rate
+    kick = 0.8 * np.sin(2 * np.pi * (50 * t + 2 * (1 - np.exp(-t / 0.02)))) * np.exp(-t / 0.08)
+    for onset in np.arange(0, seconds - 0.5, 60.0 / bpm):
+        start = int(onset * sample_rate)
+        samples[start:start + length] += kick
+    return samples[np.newaxis].astype(np.float32)
+
+def tempo_checks(backend):
+    """(name, expected BPM, detected BPM) for kick tracks and for beatless signals, which must read 0"""
+    t = np.arange(10 * SAMPLE_RATE) / SAMPLE_RATE
+    signals = [(f'{bpm} BPM kicks', bpm, kick_track(bpm)) for bpm in (90, 100, 120, 140)]
+    signals += [
+        ('steady tone', 0, (0.5 * np.sin(2 * np.pi * 440 * t))[np.newaxis].astype(np.float32)),
+        ('noise', 0, 0.3 * np.random.default_rng(0).standard_normal((1, len(t))).astype(np.float32))
+    ]
+    return [(name, bpm, backend.analyze_track(samples, SAMPLE_RATE)['tempo']) for name, bpm, samples in signals]
+
+def async_after_sync_check(backend, timeout=60):
+    """Run a layered remix synchronously, then the same as a job; returns the job's seconds or None
+
+    Job workers are forked from this process, so they inherit whatever
+    thread pools the synchronous remix started. Layers run in parallel
+    only with LAYER_WORKERS > 1, so at least 2 are used for the check.
+    None means the job failed or didn't finish within timeout.
+    """
+    client = backend.app.test_client()
+    audio = wav_bytes(synth_input(2, 2))
+    form = dict(REMIX_FORM, layers=json.dumps([{'volume': -6}, {'pitch_shift': 12, 'volume': -12}]))
+    layer_workers = backend.LAYER_WORKERS
+    backend.LAYER_WORKERS = max(layer_workers, 2)
+    try:
+        client.post('/api/remix', data=dict(form, audio=(io.BytesIO(audio), 'check.wav')))
+        response = client.post('/api/remix', data=dict(form, pitch_shift='3', audio=(io.BytesIO(audio), 'check.wav'),
+                                                       **{'async': 'true'}))
+        job_id = response.get_json()['job_id']
+        start = time.perf_counter()
+        while time.perf_counter() - start < timeout:
+            status = backend.job_status(job_id)['status']
+            if status in ('done', 'failed'):
+                return time.perf_counter() - start if status == 'done' else None
+            time.sleep(0.1)
+        return None
+    finally:
+        backend.LAYER_WORKERS = layer_workers
+        backend.result_cache.clear()
+        backend.upload_store.clear()
+
+def generation_cases(backend, seconds):
+    """(name, run, reset) for composing and rendering one track"""
+    label = f'{seconds}s'
+    score, _ = backend.compose_score('happy', 'electronic', seconds, 120, 1)
+    music = backend.render_score(score)
+
+    return [
+        (f'compose_score[{label}]', lambda: backend.compose_score('happy', 'electronic', seconds, 120, 1), None),
+        # Cold note cache, so oscillator changes show up here
+        (f'render_score[{label}]', lambda: backend.render_score(score), backend.note_cache.clear),
+        (f'export_generated[{label}]', lambda: backend.export_generated(
+            music, 'happy', 'electronic', 'bench_generated.wav'), None)
+    ]
+
+def endpoint_cases(backend, seconds, channels):
+    """(name, run, reset) for the HTTP endpoints, with caches emptied before each run"""
+    client = backend.app.test_client()
+    audio = wav_bytes(synth_input(seconds, channels))
+
+    def reset():
+        backend.result_cache.clear()
+        backend.upload_store.clear()
+
+    def post(path, **kwargs):
+        response = client.post(path, **kwargs)
+        if response.status_code != 200:
+            raise RuntimeError(f'{path} returned {response.status_code}: {response.get_data(as_text=True)}')
+
+    cases = [
+        (f'POST /api/analyze[{seconds}s/{channels}ch]', lambda: post(
+            '/api/analyze', data={'audio': (io.BytesIO(audio), 'bench.wav')}), reset),
+        (f'POST /api/remix[{seconds}s/{channels}ch]', lambda: post(
+            '/api/remix', data=dict(REMIX_FORM, audio=(io.BytesIO(audio), 'bench.wav'))), reset)
+    ]
+    # Generated tracks are mono and capped at 30 seconds
+    if channels == 1 and seconds <= 30:
+        cases.append((f'POST /api/generate[{seconds}s]', lambda: post('/api/generate', json={
+            'mood': 'happy', 'genre': 'electronic', 'duration': seconds, 'tempo': 120, 'seed': 1}), reset))
+    return cases
+
+def measure(run, reset, repeats):
+    """Median/min wall time over repeats, then peak traced memory of one more run"""
+    reset = reset or (lambda: None)
+
+    # Warm-up run so one-off costs (imports, FFT plans) aren't timed
+    reset()
+    run()
+
+    times = []
+    for _ in range(repeats):
+        reset()
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+
+    reset()
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'seconds': statistics.median(times),
+        'min_seconds': min(times),
+        'runs': repeats,
+        'peak_bytes': peak
+    }
+
+def git_revision():
+    """Current commit, or None outside a git checkout"""
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline, threshold):
+    """Print per-case changes against a baseline and return the regressions"""
+    previous = {case['name']: case for case in baseline['results']}
+    regressions = []
+
+    print(f"\nCompared with baseline {baseline['meta'].get('revision') or ''} (threshold {threshold:.0%})")
+    print(f"{'case':<44}{'time':>10}{'memory':>10}")
+    for case in results:
+        before = previous.get(case['name'])
+        if before is None:
+            print(f"{case['name']:<44}{'new':>10}")
+            continue
+
+        time_change = case['seconds'] / before['seconds'] - 1 if before['seconds'] else 0.0
+        memory_change = case['peak_bytes'] / before['peak_bytes'] - 1 if before['peak_bytes'] else 0.0
+        problems = []
+        if time_change > threshold and case['seconds'] - before['seconds'] > NOISE_FLOOR:
+            problems.append('time')
+        if memory_change > threshold and case['peak_bytes'] - before['peak_bytes'] > 1024 * 1024:
+            problems.append('memory')
+        if problems:
+            regressions.append((case['name'], problems))
+
+        flag = '  REGRESSION' if problems else ''
+        print(f"{case['name']:<44}{time_change:>+10.1%}{memory_change:>+10.1%}{flag}")
+
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the audio pipelines')
+    parser.add_argument('--lengths', type=int, nargs='+', default=DEFAULT_LENGTHS,
+                        help='input lengths in seconds')
+    parser.add_argument('--channels', type=int, nargs='+', default=DEFAULT_CHANNELS,
+                        help='input channel counts')
+    parser.add_argument('--repeats', type=int, default=3, help='timed runs per case')
+    parser.add_argument('--quick', action='store_true', help='5 second inputs, 2 runs per case')
+    parser.add_argument('--filter', default='', help='only run cases whose name contains this')
+    parser.add_argument('--output', default='bench_results.json', help='where to write results')
+    parser.add_argument('--baseline', help='results file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='allowed slowdown or memory growth before failing (0.25 = 25%%)')
+    args = parser.parse_args()
+
+    if args.quick:
+        args.lengths, args.repeats = [5], 2
+    output = os.path.abspath(args.output)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    # The app creates its folders relative to the working directory
+    workdir = tempfile.mkdtemp(prefix='bench_')
+    atexit.register(shutil.rmtree, workdir, True)
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+    import app as backend
+
+    # Timings are meaningless if the loudness normalization is wrong
+    failures = []
+    for seconds, error in loudness_checks(backend):
+        print(f'loudness of -23 LUFS tone, {seconds:g}s: {error:+.3f} LU')
+        if abs(error) > LOUDNESS_TOLERANCE:
+            failures.append(seconds)
+    if failures:
+        print(f'Loudness meter off by more than {LOUDNESS_TOLERANCE} LU at {failures} s')
+        sys.exit(1)
+
+    # Tempo drives the /api/analyze suggestions
+    wrong = []
+    for name, expected, tempo in tempo_checks(backend):
+        print(f'tempo of {name}: {tempo:.1f} BPM')
+        if abs(tempo - expected) > TEMPO_TOLERANCE:
+            wrong.append(name)
+    if wrong:
+        print(f"Tempo off by more than {TEMPO_TOLERANCE} BPM for {', '.join(wrong)}")
+        sys.exit(1)
+
+    # Background jobs must still run after a synchronous request used the layer pool
+    seconds = async_after_sync_check(backend)
+    if seconds is None:
+        print('async layered remix after a sync one: did not finish', flush=True)
+        os._exit(1)  # A stuck job worker would block a normal exit
+    print(f'async layered remix after a sync one: done in {seconds:.1f}s')
+    print()
+
+    cases = []
+    for seconds in args.lengths:
+        cases += generation_cases(backend, seconds)
+        for channels in args.channels:
+            cases += stage_cases(backend, seconds, channels)
+            cases += endpoint_cases(backend, seconds, channels)
+    cases = [case for case in cases if args.filter in case[0]]
+
+    results = []
+    print(f"{'case':<44}{'median ms':>12}{'min ms':>12}{'peak MB':>10}")
+    for name, run, reset in cases:
+        result = dict(name=name, **measure(run, reset, args.repeats))
+        results.append(result)
+        print(f"{name:<44}{result['seconds'] * 1000:>12.2f}{result['min_seconds'] * 1000:>12.2f}"
+              f"{result['peak_bytes'] / 1024 / 1024:>10.1f}")
+
+    report = {
+        'meta': {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'repeats': args.repeats
+        },
+        'results': results
+    }
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'\nResults written to {output}')
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f'\n{len(regressions)} regression(s) beyond {args.threshold:.0%}')
+            sys.exit(1)
+        print('\nNo regressions')
+
+if __name__ == '__main__':
+    main()
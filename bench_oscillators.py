@@ -0,0 +1,65 @@
+"""
+Oscillator benchmark: band-limited vs naive square/sawtooth
+
+Compares render speed and aliasing of app.render_waveform against the
+naive (hard-edged) waveforms it replaced.
+
+Usage: python bench_oscillators.py
+"""
+
+import time
+
+import numpy as np
+
+from app import SAMPLE_RATE, note_to_frequency, render_waveform
+
+# A3 up to A6, where aliasing from hard edges is worst
+FREQUENCIES = [note_to_frequency(note, octave) for octave in (3, 4, 5) for note in range(0, 12, 3)] + [1760.0]
+
+def render_naive(frequency, num_samples, waveform, sample_rate=SAMPLE_RATE):
+    """The hard-edged square/sawtooth used before band-limiting"""
+    n = np.arange(num_samples, dtype=np.float64)
+    cycle_length = sample_rate / float(frequency)
+    if waveform == 'square':
+        samples = np.where((n % cycle_length) < cycle_length * 0.5, 1.0, -1.0)
+    else:
+        samples = 2 * (n % cycle_length) / cycle_length - 1.0
+    return samples.astype(np.float32)
+
+def alias_ratio_db(samples, frequency, sample_rate=SAMPLE_RATE):
+    """Energy outside the true harmonics relative to the harmonics, in dB"""
+    window = np.blackman(len(samples))
+    power = np.abs(np.fft.rfft(samples * window)) ** 2
+    bin_width = sample_rate / len(samples)
+
+    harmonic = np.zeros(len(power), dtype=bool)
+    for k in range(1, int(sample_rate / 2 / frequency) + 1):
+        center = int(round(k * frequency / bin_width))
+        harmonic[max(center - 4, 0):center + 5] = True
+    alias = ~harmonic
+    alias[:5] = False  # DC and its window leakage are neither signal nor alias
+
+    return 10 * np.log10(power[alias].sum() / power[harmonic].sum())
+
+def time_renders(render, waveform, num_samples, repeats=20):
+    """Best-of seconds to render every test frequency once"""
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for frequency in FREQUENCIES:
+            render(frequency, num_samples, waveform)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    num_samples = SAMPLE_RATE // 2  # a half-second note
+    print(f"{'waveform':<10}{'renderer':<14}{'ms/note':>10}{'alias dB (mean)':>18}{'alias dB (worst)':>18}")
+    for waveform in ('square', 'sawtooth'):
+        for name, render in (('naive', render_naive), ('band-limited', render_waveform)):
+            seconds = time_renders(render, waveform, num_samples)
+            ratios = [alias_ratio_db(render(f, SAMPLE_RATE, waveform), f) for f in FREQUENCIES]
+            print(f"{waveform:<10}{name:<14}{seconds / len(FREQUENCIES) * 1000:>10.3f}"
+                  f"{np.mean(ratios):>18.1f}{max(ratios):>18.1f}")
+
+if __name__ == '__main__':
+    main()
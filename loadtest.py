@@ -0,0 +1,148 @@
+"""
+Slow-client load test for a running backend
+
+Opens many concurrent clients that upload or download slowly, while a
+probe measures /api/health latency, and reports how the server coped.
+Uses raw sockets with small receive buffers, so slow readers really do
+push back on the server instead of being absorbed by the kernel.
+
+Usage:
+    python app.py                  # or: uvicorn asgi:app --port 5000
+    python loadtest.py --clients 200 --mode download
+    python loadtest.py --clients 200 --mode upload --seconds 10
+"""
+
+import argparse
+import asyncio
+import json
+import socket
+import statistics
+import time
+import uuid
+
+import numpy as np
+
+from bench import synth_input, wav_bytes
+
+def build_request(method, path, host, body=b'', content_type=None):
+    """HTTP/1.1 request head plus body"""
+    head = f'{method} {path} HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n'
+    if content_type:
+        head += f'Content-Type: {content_type}\r\n'
+    if body or method == 'POST':
+        head += f'Content-Length: {len(body)}\r\n'
+    return (head + '\r\n').encode('latin-1'), body
+
+def multipart(field, filename, data):
+    """multipart/form-data body with one file field"""
+    boundary = uuid.uuid4().hex
+    body = (f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+            f'Content-Type: audio/wav\r\n\r\n').encode('latin-1') + data + f'\r\n--{boundary}--\r\n'.encode()
+    return body, f'multipart/form-data; boundary={boundary}'
+
+async def connect(host, port, receive_buffer=None):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    if receive_buffer:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, receive_buffer)
+    sock.setblocking(False)
+    await asyncio.get_running_loop().sock_connect(sock, (host, port))
+    return await asyncio.open_connection(sock=sock)
+
+async def fetch(host, port, method, path, body=b'', content_type=None,
+                send_seconds=0.0, read_rate=None, steps=50):
+    """One request; the body is sent over send_seconds and the response read at read_rate bytes/s"""
+    reader, writer = await connect(host, port, receive_buffer=16384 if read_rate else None)
+    try:
+        head, body = build_request(method, path, f'{host}:{port}', body, content_type)
+        writer.write(head)
+        size = -(-len(body) // steps) if body else 0
+        for i in range(0, len(body), size or 1):
+            writer.write(body[i:i + size])
+            await writer.drain()
+            if send_seconds:
+                await asyncio.sleep(send_seconds / steps)
+
+        status = int((await reader.readline()).split()[1])
+        received = 0
+        while True:
+            chunk = await reader.read(4096)
+            if not chunk:
+                break
+            received += len(chunk)
+            if read_rate:
+                await asyncio.sleep(len(chunk) / read_rate)
+        return status, received
+    finally:
+        writer.close()
+
+async def probe(host, port, stop, latencies):
+    """Time /api/health every 100 ms until stop is set"""
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            status, _ = await asyncio.wait_for(fetch(host, port, 'GET', '/api/health'), 30)
+            latencies.append(time.perf_counter() - start if status == 200 else float('inf'))
+        except (OSError, asyncio.TimeoutError, IndexError, ValueError):
+            latencies.append(float('inf'))
+        await asyncio.sleep(0.1)
+
+async def setup_download(host, port):
+    """Render a track to download and return its name"""
+    body = json.dumps({'mood': 'calm', 'genre': 'ambient', 'duration': 30, 'seed': 1}).encode()
+    reader, writer = await connect(host, port)
+    head, body = build_request('POST', '/api/generate', f'{host}:{port}', body, 'application/json')
+    writer.write(head + body)
+    response = await reader.read()
+    writer.close()
+    return json.loads(response.split(b'\r\n\r\n', 1)[1])['filename']
+
+def summarize(name, values):
+    finite = [value for value in values if value != float('inf')]
+    failed = len(values) - len(finite)
+    if not finite:
+        return f'{name:<16}{len(values):>6} requests, all failed'
+    return (f'{name:<16}{len(values):>6} requests{failed:>6} failed   p50 {statistics.median(finite) * 1000:8.1f} ms'
+            f'   p95 {np.percentile(finite, 95) * 1000:8.1f} ms   max {max(finite) * 1000:8.1f} ms')
+
+async def main():
+    parser = argparse.ArgumentParser(description='Load test the backend with slow clients')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--clients', type=int, default=100, help='concurrent slow clients')
+    parser.add_argument('--mode', choices=('upload', 'download'), default='download')
+    parser.add_argument('--seconds', type=float, default=10.0, help='how long each slow transfer takes')
+    args = parser.parse_args()
+
+    if args.mode == 'download':
+        filename = await setup_download(args.host, args.port)
+        size = (await fetch(args.host, args.port, 'GET', f'/api/stream/{filename}'))[1]
+        request = dict(method='GET', path=f'/api/stream/{filename}', read_rate=size / args.seconds)
+    else:
+        body, content_type = multipart('audio', 'load.wav', wav_bytes(synth_input(2, 1)))
+        request = dict(method='POST', path='/api/analyze', body=body, content_type=content_type,
+                       send_seconds=args.seconds)
+
+    stop = asyncio.Event()
+    probes = []
+    prober = asyncio.create_task(probe(args.host, args.port, stop, probes))
+
+    async def client():
+        start = time.perf_counter()
+        try:
+            status, _ = await fetch(args.host, args.port, **request)
+            return time.perf_counter() - start if status == 200 else float('inf')
+        except (OSError, IndexError, ValueError):
+            return float('inf')
+
+    start = time.perf_counter()
+    durations = await asyncio.gather(*(client() for _ in range(args.clients)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await prober
+
+    print(f'{args.clients} slow {args.mode} clients, {args.seconds:.0f} s each, finished in {elapsed:.1f} s')
+    print(summarize('slow clients', durations))
+    print(summarize('health probes', probes))
+
+if __name__ == '__main__':
+    asyncio.run(main())